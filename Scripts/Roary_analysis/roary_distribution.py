@@ -1,45 +1,48 @@
 import argparse
+from argparse import ArgumentTypeError
 import os
-import pandas as pd
+import sys
+from pathlib import Path
+
 import plotly.graph_objects as go
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Scripts directory with the shared common package
+from common.roary import ROARY_FILE, load_presence_absence
+from common.pangenome import CATEGORIES, threshold_arguments, category_thresholds, classify_genes, category_totals
+
 # Set up argument parser
 parser = argparse.ArgumentParser(description='Generate a pie chart for gene distribution in core, soft-core, shell, and cloud categories using Plotly.')
 parser.add_argument('-i', '--input_directory', type=str, help='Input directory where Roary output files are located', required=True)
 parser.add_argument('-o', '--output_directory', type=str, help='Output directory for the pie chart.', default='.')
+threshold_arguments(parser)
 
 # Parse arguments
 args = parser.parse_args()
+try:
+    thresholds = category_thresholds(args)
+except ArgumentTypeError as e:
+    parser.error(str(e))
 
 # Check if output directory exists, if not, create it
 if not os.path.isdir(args.output_directory):
     os.makedirs(args.output_directory)
 
 # Construct the full path to the gene_presence_absence.csv file
-gene_presence_absence_file = os.path.join(args.input_directory, 'gene_presence_absence.csv')
+gene_presence_absence_file = os.path.join(args.input_directory, ROARY_FILE)
 
-# Load the gene_presence_absence.csv file
-data = pd.read_csv(gene_presence_absence_file)
+# Load isolates and isolate counts of genes of the gene_presence_absence.csv file (streamed once and cached next to it)
+isolates, isolate_counts = load_presence_absence(gene_presence_absence_file, 'isolates', 'counts')
 
 # Calculate the number of samples
-num_samples = len(data.columns) - 14  # Adjust the index based on your data
-
-# Calculate the distribution of genes
-total_genes = len(data.index)
-core_genes = data.iloc[:, 14:].count(axis=1) == num_samples
-soft_core_genes = data.iloc[:, 14:].count(axis=1) >= 0.95 * num_samples
-shell_genes = data.iloc[:, 14:].count(axis=1) >= 0.15 * num_samples
-cloud_genes = data.iloc[:, 14:].count(axis=1) < 0.15 * num_samples
+num_samples = len(isolates)
 
-# Convert booleans to integers
-core_count = core_genes.sum()
-soft_core_count = soft_core_genes.sum() - core_count  # Exclude core genes
-shell_count = shell_genes.sum() - soft_core_genes.sum()  # Exclude soft-core genes
-cloud_count = total_genes - shell_genes.sum()  # All genes not in shell or above
+# Calculate the distribution of genes (isolate counts are computed once, categories in one step)
+categories = classify_genes(isolate_counts, num_samples, thresholds)
+total_genes = len(categories)
 
 # Prepare pie chart data
-sizes = [core_count, soft_core_count, shell_count, cloud_count]
-labels = ['Core', 'Soft-core', 'Shell', 'Cloud']
+sizes = category_totals(categories).tolist()
+labels = list(CATEGORIES)
 
 # Plot the pie chart only if there are genes in each category
 if any(size > 0 for size in sizes):
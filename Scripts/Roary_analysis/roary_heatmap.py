@@ -1,13 +1,64 @@
 import argparse
 import os
+import sys
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Scripts directory with the shared common package
+from common.roary import ROARY_FILE, load_presence_absence, presence_matrix
+from common.plotting import pyplot
+
+# Size (inches) and resolution of the heatmap, the raster image has at most one cell per pixel
+FIGURE_SIZE = (20, 10)
+DPI = 100
 
 # Set up argument parser
 parser = argparse.ArgumentParser(description='Generate a heatmap for gene presence and absence.')
 parser.add_argument('-i', '--input_directory', type=str, help='Input directory where gene_presence_absence.csv is located', required=True)
 parser.add_argument('-o', '--output_directory', type=str, help='Output directory for the heatmap.', default='.')
+parser.add_argument('-r', '--raster', action='store_true',
+                    help='Draw the matrix as one raster image, blocks of genes and genomes are averaged down to the '
+                         'pixel resolution (fast for full pangenomes)')
+parser.add_argument('--order', choices=['input', 'count', 'cluster'], default='input',
+                    help='Order of genes and genomes: input (CSV order), count (by number of genes/genomes) or '
+                         'cluster (genomes by average linkage of gene content, genes by count) (default: input)')
+
+
+def presence_order(matrix, order):
+    # Row (genomes) and column (genes) order of the genomes x genes presence matrix
+    gene_counts = matrix.sum(axis=0)
+    genome_counts = matrix.sum(axis=1)
+    if order == 'input':
+        return np.arange(matrix.shape[0]), np.arange(matrix.shape[1])
+    genes = np.argsort(-gene_counts, kind='stable')
+    if order == 'count' or matrix.shape[0] < 2:
+        return np.argsort(-genome_counts, kind='stable'), genes
+
+    from scipy.cluster.hierarchy import leaves_list, linkage
+    from scipy.spatial.distance import squareform
+    # Hamming distances of gene content from one matrix product: |a| + |b| - 2 * |a & b|
+    values = matrix.astype(np.float32)
+    shared = values @ values.T
+    distances = genome_counts[:, None] + genome_counts[None, :] - 2 * shared
+    np.fill_diagonal(distances, 0)
+    return leaves_list(linkage(squareform(np.maximum(distances, 0), checks=False), 'average')), genes
+
+
+def block_means(matrix, max_rows, max_columns):
+    # Fraction of present cells of blocks of the matrix, at most MAX_ROWS x MAX_COLUMNS blocks
+    rows_step = -(-matrix.shape[0] // max_rows)
+    columns_step = -(-matrix.shape[1] // max_columns)
+    row_starts = np.arange(0, matrix.shape[0], rows_step)
+    column_starts = np.arange(0, matrix.shape[1], columns_step)
+
+    sums = np.add.reduceat(matrix, column_starts, axis=1, dtype=np.uint32)
+    sums = np.add.reduceat(sums, row_starts, axis=0, dtype=np.uint32)
+    row_sizes = np.diff(np.append(row_starts, matrix.shape[0]))
+    column_sizes = np.diff(np.append(column_starts, matrix.shape[1]))
+    return sums / np.outer(row_sizes, column_sizes)
+
 
 # Parse arguments
 args = parser.parse_args()
@@ -17,26 +68,38 @@ if not os.path.isdir(args.output_directory):
     os.makedirs(args.output_directory)
 
 # Construct the full path to the gene_presence_absence.csv file
-gene_presence_absence_file = os.path.join(args.input_directory, 'gene_presence_absence.csv')
+gene_presence_absence_file = os.path.join(args.input_directory, ROARY_FILE)
 
-# Load the gene_presence_absence.csv file
-data = pd.read_csv(gene_presence_absence_file)
+# Load isolates and presence bits of the gene_presence_absence.csv file (cached next to it)
+isolates, presence = load_presence_absence(gene_presence_absence_file, 'isolates', 'presence')
 
-# The file contains a lot of information. For presence/absence, we focus on gene names and their presence (1) or absence (0) across genomes.
-# Typically, the 'Gene' column holds gene identifiers, and the following columns hold presence (1) or absence (0) data.
+# Presence of genes (columns) in genomes (rows), transposed to make the heatmap horizontal
+matrix = presence_matrix(presence, len(isolates)).T
+genome_order, gene_order = presence_order(matrix, args.order)
+matrix = matrix[genome_order][:, gene_order]
 
-# Extracting relevant columns (Adjust the range according to your specific file structure)
-presence_absence = data.iloc[:, 14:].notnull().astype(int)
+# Creating a heatmap (matplotlib is imported only now, with the headless Agg backend)
+plt = pyplot()
 
-# Creating a heatmap
-plt.figure(figsize=(20, 10))
-sns.heatmap(presence_absence.transpose(), cmap="YlGnBu", yticklabels=False)  # Transpose to make the heatmap horizontal
+plt.figure(figsize=FIGURE_SIZE)
+if args.raster:
+    # One image instead of a rectangle per cell, each pixel shows the fraction of present cells of its block,
+    # the extent keeps the axes in gene and genome positions whatever the block size
+    image = block_means(matrix, FIGURE_SIZE[1] * DPI, FIGURE_SIZE[0] * DPI)
+    plt.imshow(image, cmap="YlGnBu", vmin=0, vmax=1, aspect='auto', interpolation='nearest',
+               extent=(0, matrix.shape[1], matrix.shape[0], 0))
+    plt.colorbar()
+    plt.yticks([])
+else:
+    import seaborn as sns
+    presence_absence = pd.DataFrame(matrix.astype(int), index=isolates[genome_order])
+    sns.heatmap(presence_absence, cmap="YlGnBu", yticklabels=False)
 plt.title('Gene Presence and Absence Heatmap')
-plt.xlabel('Genomes')
-plt.ylabel('Genes')
+plt.xlabel('Genes')
+plt.ylabel('Genomes')
 
 # Save the heatmap
 heatmap_file = os.path.join(args.output_directory, 'gene_presence_absence_heatmap.png')
-plt.savefig(heatmap_file)
+plt.savefig(heatmap_file, dpi=DPI)
 print(f"Heatmap saved to {heatmap_file}")
 plt.close()
@@ -1,8 +1,11 @@
-import pandas as pd
 import argparse
-import venn
-import matplotlib.pyplot as plt
 import os
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Scripts directory with the shared common package
+from common.roary import ROARY_FILE, load_presence_absence, presence_matrix
+from common.plotting import pyplot
 
 
 def read_samples(file_path):
@@ -12,14 +15,18 @@ def read_samples(file_path):
 
 
 def process_gene_presence_absence(file_path, samples):
-    df = pd.read_csv(file_path)
+    genes, isolates, presence = load_presence_absence(file_path, 'genes', 'isolates', 'presence')
+    presence = presence_matrix(presence, len(isolates))
+    isolate_columns = {isolate: column for column, isolate in enumerate(isolates)}
     # Extracting genes for each sample and converting them to sets
-    gene_data = {sample: set(df[df[sample].notna()]['Gene']) for sample in samples}
+    gene_data = {sample: set(genes[presence[:, isolate_columns[sample]]]) for sample in samples}
     return gene_data
 
 
 def create_venn_diagrams(gene_data, output_dir):
     if 2 <= len(gene_data) <= 6:
+        plt = pyplot()
+        import venn
         venn.venn(gene_data)
         plot_file_path = os.path.join(output_dir, 'venn_diagram.png')
         plt.savefig(plot_file_path, bbox_inches='tight')
@@ -39,13 +46,11 @@ def main():
     output_dir = args.output
 
     samples = read_samples(samples_file)
-    gene_presence_absence_file = f"{input_dir}/gene_presence_absence.csv"
+    gene_presence_absence_file = f"{input_dir}/{ROARY_FILE}"
 
     gene_data = process_gene_presence_absence(gene_presence_absence_file, samples)
     create_venn_diagrams(gene_data, output_dir)
 
-    df = pd.read_csv(gene_presence_absence_file)
-
 
 if __name__ == "__main__":
     main()
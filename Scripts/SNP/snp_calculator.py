@@ -1,54 +1,439 @@
 import argparse
-import os
 import glob
+import gzip
+import io
+import math
+import os
+import sys
+from itertools import groupby
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Scripts directory with the shared common package
+from common.iupac import MASK_TABLE
+from common.parallel import parallel_map
+
+# Read buffer for plain and gzip-compressed VCF files (1 MiB)
+BUFFER_SIZE = 1 << 20
+# Uncompressed VCFs are split into byte-range chunks of at least this size for several workers (64 MiB)
+MIN_CHUNK_SIZE = 64 << 20
+# Maximum size of the XOR block of the pairwise SNP distances (4 MiB)
+DISTANCE_BLOCK_SIZE = 4 << 20
+DISTANCE_MATRIX_FILE = 'snp_distance_matrix.tsv'
+
+# Order of the non-SNP categories in the analysis file
+NON_SNP_CATEGORIES = ('Indel', 'MNP', 'Symbolic', 'No ALT')
+
+# Transition = both bases are purines (A, G => R) or pyrimidines (C, T => Y)
+BASE_MASKS = MASK_TABLE.tolist()
+TRANSITION_MASKS = {BASE_MASKS[ord('R')], BASE_MASKS[ord('Y')]}
+NUCLEOTIDES = {b'A', b'C', b'G', b'T'}
+
+# Genotype classes per sample (columns of the genotype counts)
+GENOTYPE_CLASSES = ('HomRef', 'Het', 'HomAlt', 'Missing')
+HOM_REF, HET, HOM_ALT, MISSING = range(len(GENOTYPE_CLASSES))
+genotype_classes_cache = {}
+called_alleles_cache = {}
+# Genotype classes are added to the counts in batches of this number of genotypes
+GENOTYPE_BATCH_SIZE = 1 << 20
+
+
+def vcf_stem(vcf_filename):
+    # {name}.vcf or {name}.vcf.gz => {name}
+    vcf_name = os.path.basename(vcf_filename)
+    vcf_name = vcf_name[:-len('.gz')] if vcf_name.endswith('.gz') else vcf_name
+    return vcf_name[:-len('.vcf')] if vcf_name.endswith('.vcf') else vcf_name
+
+
+def open_vcf(vcf_file):
+    # Binary buffered handle of a plain or gzip/bgzip-compressed (multi-member gzip) VCF file
+    if vcf_file.endswith('.gz'):
+        return io.BufferedReader(gzip.open(vcf_file, 'rb'), buffer_size=BUFFER_SIZE)
+    return open(vcf_file, 'rb', buffering=BUFFER_SIZE)
+
+
+def genotype_class(genotype):
+    # 0/0 or 0 => HomRef, 0/1 or 1|2 => Het, 1/1 or 1 => HomAlt, any missing allele (./1, .) => Missing
+    genotype_class_index = genotype_classes_cache.get(genotype)
+    if genotype_class_index is None:
+        alleles = genotype.replace(b'|', b'/').split(b'/')
+        if b'.' in alleles or b'' in alleles:
+            genotype_class_index = MISSING
+        elif len(set(alleles)) > 1:
+            genotype_class_index = HET
+        else:
+            genotype_class_index = HOM_REF if alleles[0] == b'0' else HOM_ALT
+        genotype_classes_cache[genotype] = genotype_class_index
+    return genotype_class_index
+
+
+def called_alleles(genotype):
+    # ALT allele indices called by the genotype: 0/1 => (1,), 1|2 => (1, 2), 0/0 and ./. => ()
+    alleles = called_alleles_cache.get(genotype)
+    if alleles is None:
+        alleles = tuple(sorted({int(allele) for allele in genotype.replace(b'|', b'/').split(b'/')
+                                if allele.isdigit() and allele != b'0'}))
+        called_alleles_cache[genotype] = alleles
+    return alleles
+
+
+def add_genotype_classes(genotype_counts, genotype_batch):
+    # Batch has classes of whole lines (samples in order) => counts per sample and class, the batch is emptied
+    samples_number, classes_number = genotype_counts.shape
+    classes = np.array(genotype_batch, dtype=np.int64).reshape(-1, samples_number)
+    classes += np.arange(samples_number) * classes_number
+    genotype_counts += np.bincount(classes.ravel(), minlength=genotype_counts.size).reshape(genotype_counts.shape)
+    genotype_batch.clear()
+
+
+def empty_statistics(samples):
+    return {
+        'variants': 0,
+        'alleles': 0,
+        'snp_sites': 0,
+        'snps': 0,
+        'multiallelic': 0,
+        'non_snp_categories': dict.fromkeys(NON_SNP_CATEGORIES, 0),
+        'transitions': 0,
+        'transversions': 0,
+        'indel_lengths': {},
+        'samples': samples,
+        'genotypes': np.zeros((len(samples), len(GENOTYPE_CLASSES)), dtype=np.int64)
+    }
+
+
+def read_samples(handle):
+    # Skip meta-information lines and return sample names of the #CHROM header line (handle stays after it)
+    for line in handle:
+        if line.startswith(b'#CHROM'):
+            return [sample.decode() for sample in line.rstrip(b'\r\n').split(b'\t')[9:]]
+        if not line.startswith(b'#'):
+            raise ValueError(f'VCF file without #CHROM header line: {handle.name}')
+    return []
+
+
+def count_records(lines, statistics):
+    """
+    Count data lines of the VCF into statistics in one pass, multi-allelic sites are decomposed into ALT alleles
+    (a site is a SNP site when all its ALT alleles are SNPs):
+        SNP         REF and ALT are single bases (transition or transversion for A, C, G, T)
+        Indel       REF and ALT lengths differ (length = len(ALT) - len(REF))
+        MNP         REF and ALT are several bases of the same length
+        Symbolic    <DEL>, breakends and '*' (overlapping deletion)
+        No ALT      '.' (no variant at the site)
+    Only CHROM..ALT columns are split for sites-only VCFs, INFO is never parsed
+    """
+    samples_number, genotype_batch = len(statistics['samples']), []
+    max_split = 9 if samples_number else 5
+    non_snp_categories, indel_lengths = statistics['non_snp_categories'], statistics['indel_lengths']
+    variants = alleles = snp_sites = snps = multiallelic = transitions = transversions = 0
+
+    for line in lines:
+        if line.startswith(b'#'):
+            continue
+        fields = line.rstrip(b'\r\n').split(b'\t', max_split)
+        if len(fields) < 5:
+            continue
+        variants += 1
+
+        ref, alt_alleles = fields[3].upper(), fields[4].upper().split(b',')
+        alleles += len(alt_alleles)
+        if len(alt_alleles) > 1:
+            multiallelic += 1
+
+        # SNP alleles counted before the site, the site is a SNP site when all its ALT alleles are SNPs
+        site_snps = snps
+        for alt in alt_alleles:
+            if len(ref) == 1 and len(alt) == 1 and alt not in (b'.', b'*'):
+                snps += 1
+                if ref in NUCLEOTIDES and alt in NUCLEOTIDES:
+                    if (BASE_MASKS[ref[0]] | BASE_MASKS[alt[0]]) in TRANSITION_MASKS:
+                        transitions += 1
+                    else:
+                        transversions += 1
+            elif alt == b'.':
+                non_snp_categories['No ALT'] += 1
+            elif alt == b'*' or alt.startswith(b'<') or b'[' in alt or b']' in alt:
+                non_snp_categories['Symbolic'] += 1
+            elif len(ref) != len(alt):
+                non_snp_categories['Indel'] += 1
+                indel_lengths[len(alt) - len(ref)] = indel_lengths.get(len(alt) - len(ref), 0) + 1
+            else:
+                non_snp_categories['MNP'] += 1
+        if snps - site_snps == len(alt_alleles):
+            snp_sites += 1
+
+        # GT is the first FORMAT key if it is present
+        if len(fields) == 10 and fields[8].split(b':', 1)[0] == b'GT':
+            if fields[8] == b'GT':
+                genotypes = fields[9].split(b'\t')
+            else:
+                genotypes = [sample.split(b':', 1)[0] for sample in fields[9].split(b'\t')]
+            if len(genotypes) == samples_number:
+                genotype_batch.extend([genotype_class(genotype) for genotype in genotypes])
+                if len(genotype_batch) >= GENOTYPE_BATCH_SIZE:
+                    add_genotype_classes(statistics['genotypes'], genotype_batch)
+
+    if genotype_batch:
+        add_genotype_classes(statistics['genotypes'], genotype_batch)
+
+    statistics['variants'] += variants
+    statistics['alleles'] += alleles
+    statistics['snp_sites'] += snp_sites
+    statistics['snps'] += snps
+    statistics['multiallelic'] += multiallelic
+    statistics['transitions'] += transitions
+    statistics['transversions'] += transversions
+
+    return statistics
+
 
 def parse_vcf(vcf_file):
-    total_variants = 0
-    total_snps = 0
-    total_non_snps = 0
-    non_snp_categories = {}
-
-    with open(vcf_file, 'r') as file:
-        for line in file:
-            if line.startswith('#'):
+    # Stream the VCF once, memory doesn't depend on the number of records
+    with open_vcf(vcf_file) as handle:
+        statistics = empty_statistics(read_samples(handle))
+        return count_records(handle, statistics)
+
+
+def chunk_lines(handle, chunk_start, chunk_end):
+    # Lines starting inside chunk_start..chunk_end - 1 (chunk_start is the start of a line)
+    handle.seek(chunk_start)
+    position = chunk_start
+    for line in handle:
+        if position >= chunk_end:
+            break
+        yield line
+        position += len(line)
+
+
+def parse_vcf_chunk(vcf_file, chunk_start=None, chunk_end=None):
+    # Statistics of the lines of an uncompressed VCF chunk, the whole file without a chunk
+    if chunk_start is None:
+        return parse_vcf(vcf_file)
+    with open_vcf(vcf_file) as handle:
+        statistics = empty_statistics(read_samples(handle))
+        return count_records(chunk_lines(handle, chunk_start, chunk_end), statistics)
+
+
+def vcf_chunks(vcf_file, workers):
+    """
+    Byte ranges [(vcf_file, chunk start, chunk end), ...] of the VCF body aligned to line starts, one range per
+    worker but not smaller than MIN_CHUNK_SIZE. Compressed files can't be read from an offset, they are a single task
+    """
+    file_size = os.path.getsize(vcf_file)
+    if vcf_file.endswith('.gz') or workers < 2 or file_size < 2 * MIN_CHUNK_SIZE:
+        return [(vcf_file, None, None)]
+
+    with open_vcf(vcf_file) as handle:
+        # Body starts right after the #CHROM line
+        read_samples(handle)
+        body_start = handle.tell()
+
+        chunks_number = max(1, min(workers, (file_size - body_start) // MIN_CHUNK_SIZE))
+        boundaries = [body_start]
+        for chunk_index in range(1, chunks_number):
+            # Next line start after the byte before the boundary (the boundary itself if a line starts there)
+            handle.seek(body_start + (file_size - body_start) * chunk_index // chunks_number - 1)
+            handle.readline()
+            boundaries.append(max(handle.tell(), boundaries[-1]))
+        boundaries.append(file_size)
+
+    return [(vcf_file, chunk_start, chunk_end) for chunk_start, chunk_end in zip(boundaries, boundaries[1:])]
+
+
+def merge_statistics(statistics, chunk_statistics):
+    # Add statistics of the next chunk of the same VCF file (counters are plain sums)
+    for key in ('variants', 'alleles', 'snp_sites', 'snps', 'multiallelic', 'transitions', 'transversions'):
+        statistics[key] += chunk_statistics[key]
+    for category, count in chunk_statistics['non_snp_categories'].items():
+        statistics['non_snp_categories'][category] += count
+    for length, count in chunk_statistics['indel_lengths'].items():
+        statistics['indel_lengths'][length] = statistics['indel_lengths'].get(length, 0) + count
+    statistics['genotypes'] += chunk_statistics['genotypes']
+    return statistics
+
+
+def analysis_lines(statistics):
+    non_snp_categories = statistics['non_snp_categories']
+    ts_tv = round(statistics['transitions'] / statistics['transversions'], 3) if statistics['transversions'] else 'N/A'
+
+    # Totals count sites as before (SNPs + Non-SNP Variants = Variants), categories count ALT alleles
+    analysis_data = [
+        f"Total Variants: {statistics['variants']}",
+        f"Total SNPs: {statistics['snp_sites']}",
+        f"Total Non-SNP Variants: {statistics['variants'] - statistics['snp_sites']}",
+        f"Total Alleles: {statistics['alleles']}",
+        f"SNP Alleles: {statistics['snps']}",
+        f"Non-SNP Alleles: {sum(non_snp_categories.values())}"
+    ] + [f"{category}: {count}" for category, count in non_snp_categories.items() if count] + [
+        f"Multi-allelic Sites: {statistics['multiallelic']}",
+        f"Transitions: {statistics['transitions']}",
+        f"Transversions: {statistics['transversions']}",
+        f"Ts/Tv: {ts_tv}"
+    ] + [f"Indel Length {length:+d}: {count}" for length, count in sorted(statistics['indel_lengths'].items())]
+
+    for sample, genotype_counts in zip(statistics['samples'], statistics['genotypes']):
+        analysis_data.append(f"Sample {sample}: " + ' | '.join(
+            f"{genotype_class_name} {count}" for genotype_class_name, count in zip(GENOTYPE_CLASSES, genotype_counts)))
+
+    return analysis_data
+
+
+def snp_calls(vcf_file):
+    """
+    SNP alleles called for the samples of the VCF (a sites-only VCF is a single sample named after the file):
+        (sample names, [b'CHROM\tPOS\tALT', ...], [sample index, ...])       one site and index per called allele
+    A genotype calls its ALT alleles (0/1, 1/1, 1), missing genotypes are treated as reference
+    """
+    sites, sample_indices = [], []
+    with open_vcf(vcf_file) as handle:
+        samples = read_samples(handle)
+        for line in handle:
+            if line.startswith(b'#'):
+                continue
+            fields = line.rstrip(b'\r\n').split(b'\t', 9 if samples else 5)
+            if len(fields) < 5 or len(fields[3]) != 1:
                 continue
-            total_variants += 1
 
-            data = line.strip().split('\t')
-            ref, alt = data[3], data[4]
+            site = fields[0] + b'\t' + fields[1] + b'\t'
+            snp_alleles = {allele_index: site + alt for allele_index, alt in enumerate(fields[4].upper().split(b','), 1)
+                           if len(alt) == 1 and alt not in (b'.', b'*')}
+            if not snp_alleles:
+                continue
 
-            if len(ref) == 1 and len(alt) == 1:
-                total_snps += 1
-            else:
-                total_non_snps += 1
-                variant_type = "Indel" if "INDEL" in line else "Complex"
-                non_snp_categories[variant_type] = non_snp_categories.get(variant_type, 0) + 1
+            if not samples:
+                sites.extend(snp_alleles.values())
+                sample_indices.extend([0] * len(snp_alleles))
+            elif len(fields) == 10 and fields[8].split(b':', 1)[0] == b'GT':
+                genotypes = fields[9].split(b'\t')
+                if fields[8] != b'GT':
+                    genotypes = [sample.split(b':', 1)[0] for sample in genotypes]
+                for sample_index, genotype in enumerate(genotypes):
+                    for allele_index in called_alleles(genotype):
+                        if allele_index in snp_alleles:
+                            sites.append(snp_alleles[allele_index])
+                            sample_indices.append(sample_index)
+
+    return samples or [vcf_stem(vcf_file)], sites, sample_indices
+
+
+def packed_calls(rows, columns, rows_number, columns_number):
+    # Sparse site x sample calls (row = sample, column = site) packed into uint64 words of bits per sample
+    words_number = max(1, (columns_number + 63) // 64)
+    packed = np.zeros((rows_number, words_number * 8), dtype=np.uint8)
+    columns = np.asarray(columns, dtype=np.int64)
+    np.bitwise_or.at(packed, (np.asarray(rows, dtype=np.int64), columns >> 3),
+                     (1 << (columns & 7)).astype(np.uint8))
+    return packed.view(np.uint64)
+
+
+def popcount(words):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    # NumPy < 2.0: bit counts of the bytes
+    return np.unpackbits(words.view(np.uint8), axis=-1).reshape(*words.shape, 64).sum(axis=-1, dtype=np.uint8)
+
+
+def pairwise_xor_popcount(packed):
+    """
+    Number of different bits for all pairs of rows. The upper triangle is computed by square tiles of rows x rows and
+    by chunks of words of very long rows, so every XOR block is at most DISTANCE_BLOCK_SIZE bytes for any number
+    of rows and words
+    """
+    rows_number, words_number = packed.shape
+    distances = np.zeros((rows_number, rows_number), dtype=np.int64)
+    block_words = max(1, min(words_number, DISTANCE_BLOCK_SIZE // 8))
+    block_rows = max(1, math.isqrt(DISTANCE_BLOCK_SIZE // (8 * block_words)))
+    for row_start in range(0, rows_number, block_rows):
+        row_end = min(row_start + block_rows, rows_number)
+        for column_start in range(row_start, rows_number, block_rows):
+            column_end = min(column_start + block_rows, rows_number)
+            for word_start in range(0, words_number, block_words):
+                words = slice(word_start, word_start + block_words)
+                xor = packed[row_start:row_end, None, words] ^ packed[None, column_start:column_end, words]
+                distances[row_start:row_end, column_start:column_end] += popcount(xor).sum(axis=2, dtype=np.int64)
+    upper = np.triu(distances, 1)
+    return upper + upper.T
+
+
+def snp_distance_matrix(file_calls):
+    """
+    Pairwise SNP distances of all samples from snp_calls of the VCF files: (sample names, distance matrix).
+    Distance = number of positions with different calls (exact for haploid or homozygous calls, e.g. isolates).
+    With bits per called allele (A) and per position with any call (P): XOR(A) counts positions called in only one
+    sample once and positions with different ALT twice, XOR(P) counts only the first ones, so both are packed
+    into one row per sample: distance = (popcount(XOR(A)) + popcount(XOR(P))) / 2
+    """
+    samples, allele_columns, rows, allele_indices = [], {}, [], []
+    for vcf_file, (file_samples, sites, sample_indices) in file_calls:
+        rows.append(np.asarray(sample_indices, dtype=np.int64) + len(samples))
+        samples.extend((vcf_stem(vcf_file), sample) for sample in file_samples)
+        allele_indices.extend([allele_columns.setdefault(site, len(allele_columns)) for site in sites])
+
+    # Positions of the alleles (CHROM\tPOS of CHROM\tPOS\tALT)
+    position_columns = {}
+    allele_positions = np.array([position_columns.setdefault(site[:site.rfind(b'\t')], len(position_columns))
+                                 for site in allele_columns], dtype=np.int64)
+    allele_indices = np.array(allele_indices, dtype=np.int64)
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+
+    # Sample names repeated in several files get the file name
+    name_counts = {}
+    for _, sample in samples:
+        name_counts[sample] = name_counts.get(sample, 0) + 1
+    sample_names = [sample if name_counts[sample] == 1 else f'{stem}:{sample}' for stem, sample in samples]
+
+    packed = np.hstack([packed_calls(rows, allele_indices, len(samples), len(allele_columns)),
+                        packed_calls(rows, allele_positions[allele_indices], len(samples), len(position_columns))])
+
+    return sample_names, pairwise_xor_popcount(packed) // 2
+
+
+def write_distance_matrix(output_dir, sample_names, distances):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, DISTANCE_MATRIX_FILE), 'w') as output_file:
+        output_file.write('\t'.join(['snp-dists'] + sample_names) + '\n')
+        for sample, sample_distances in zip(sample_names, distances):
+            output_file.write('\t'.join([sample] + list(map(str, sample_distances.tolist()))) + '\n')
 
-    return total_variants, total_snps, total_non_snps, non_snp_categories
 
 def write_analysis(output_dir, vcf_filename, analysis_data):
     os.makedirs(output_dir, exist_ok=True)
-    output_filename = os.path.join(output_dir, os.path.basename(vcf_filename).replace('.vcf', '_analysis.txt'))
+    output_filename = os.path.join(output_dir, f'{vcf_stem(vcf_filename)}_analysis.txt')
 
     with open(output_filename, 'w') as output_file:
         for line in analysis_data:
             output_file.write(line + "\n")
 
+
 def main():
-    parser = argparse.ArgumentParser(description='VCF File Analysis')
+    parser = argparse.ArgumentParser(description='VCF File Analysis (plain .vcf and gzip/bgzip-compressed .vcf.gz)')
     parser.add_argument('-i', '--input', required=True, help='Input directory containing VCF files')
     parser.add_argument('-o', '--output', required=True, help='Output directory for analysis files')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of worker processes for files and chunks of large uncompressed files (default: 1)')
+    parser.add_argument('-d', '--distance', action='store_true',
+                        help=f'Also write pairwise SNP distances of all samples to {DISTANCE_MATRIX_FILE}')
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error(f'Number of workers should be at least 1, got {args.workers}')
+
+    # Chunks of a file are consecutive tasks, their statistics are merged in order after the workers
+    vcf_files = glob.glob(os.path.join(args.input, '*.vcf')) + glob.glob(os.path.join(args.input, '*.vcf.gz'))
+    tasks = [chunk for vcf_file in sorted(vcf_files) for chunk in vcf_chunks(vcf_file, args.workers)]
+    chunk_results = parallel_map(parse_vcf_chunk, args.workers, *zip(*tasks)) if tasks else []
 
-    for vcf_file in glob.glob(os.path.join(args.input, '*.vcf')):
-        total_variants, total_snps, total_non_snps, non_snp_categories = parse_vcf(vcf_file)
-        analysis_data = [
-            f"Total Variants: {total_variants}",
-            f"Total SNPs: {total_snps}",
-            f"Total Non-SNP Variants: {total_non_snps}"
-        ] + [f"{category}: {count}" for category, count in non_snp_categories.items()]
+    for vcf_file, file_results in groupby(zip(tasks, chunk_results), key=lambda task_result: task_result[0][0]):
+        statistics = next(file_results)[1]
+        for _, chunk_statistics in file_results:
+            merge_statistics(statistics, chunk_statistics)
+        write_analysis(args.output, vcf_file, analysis_lines(statistics))
 
-        write_analysis(args.output, vcf_file, analysis_data)
+    if args.distance:
+        vcf_files = sorted(vcf_files)
+        file_calls = zip(vcf_files, parallel_map(snp_calls, args.workers, vcf_files))
+        write_distance_matrix(args.output, *snp_distance_matrix(file_calls))
 
 if __name__ == "__main__":
     main()
@@ -3,30 +3,20 @@
 # 3, 5
 
 
-from collections import defaultdict
+from pathlib import Path
 import sys
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Scripts directory with the shared common package
+from common.fasta_reader import fasta_records
+
 if len(sys.argv)!=3: 
     print("Usage:python3 NCBI_assembly_filter_defaultdict.py <input.txt> <output.txt> ")
     sys.exit()
 
-handle = open(sys.argv[1],'r')
-lines = handle.read().split('\n')
-
-my_dict= defaultdict(list)
-for line in lines:
-    if line.startswith(">"):
-        header = line
-    else:
-        my_dict[header].append(line)
-handle.close()
-
 outfile=open(sys.argv[2],'w')
-for line1 in my_dict.keys():
+for line1, sequence in fasta_records(sys.argv[1]):
     if line1.startswith(">"):
         (length,random, cov) = line1.split('-')[0].split('_')[3:]
         if float(length) >= 200 and float(cov) >= 5:
-            outfile.write(line1+"\n"+''.join(my_dict[line1])+'\n')
+            outfile.write(line1+"\n"+sequence+'\n')
 outfile.close()
-
-
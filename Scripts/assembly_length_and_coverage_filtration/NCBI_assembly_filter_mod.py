@@ -1,6 +1,14 @@
-from collections import defaultdict
 from argparse import ArgumentParser, ArgumentError, RawTextHelpFormatter
+from pathlib import Path
 import os
+import sys
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Scripts directory with the shared common package
+from common.fasta_reader import fasta_records
+from common.fasta_index import load_header_index, copy_records
+from common.manifest import load_manifest, save_manifest, incremental_map
 
 desc = "Custom script for trimming scaffolds.fasta files at the parameters of the minimum length and " \
        "minimum coverage specified by the user. If the length or coverage parameters are not provided, the " \
@@ -12,20 +20,139 @@ desc = "Custom script for trimming scaffolds.fasta files at the parameters of th
        "department), May 22/2023, Github <https://github.com/edgeemer>"
 
 usage = "\npython3 <script_name>.py [-h] -i /path/to/input/directory -o /path/to/output/directory " \
-        "[-l MIN_LENGTH] [-c MIN_COVERAGE]\n\n" \
+        "[-l MIN_LENGTH [MIN_LENGTH ...]] [-c MIN_COVERAGE [MIN_COVERAGE ...]] [-x] [-s] [-I]\n\n" \
         "Options:\n" \
         "-i, --input             Input directory path\n" \
         "-o, --output            Output directory path\n" \
         "-l, --length            Minimum length to pass the filter (default: 200)\n" \
-        "-c, --coverage         Minimum coverage to pass the filter (default: 5)\n"
+        "-c, --coverage         Minimum coverage to pass the filter (default: 5)\n" \
+        "-x, --index             Header-only scan: copy passing records by byte ranges from the cached header " \
+        "index ({name}.fasta.hdx)\n" \
+        "-s, --sweep             Threshold sweep: report all combinations of several -l and -c values in " \
+        "threshold_sweep.md (no FASTA output)\n" \
+        "-I, --incremental       Skip assemblies unchanged since the previous run with the same thresholds\n"
 
 parser = ArgumentParser(description=desc, formatter_class=RawTextHelpFormatter, usage=usage)
 parser.add_argument('-i', '--input', type=str, help='Input directory path', required=True)
 parser.add_argument('-o', '--output', type=str, help='Output directory path', required=True)
-parser.add_argument('-l', '--length', type=int, help='Minimum length threshold for sequence filtering (default: 200)',
-                    default=200)
-parser.add_argument('-c', '--coverage', type=int, help='Minimum coverage threshold for sequence filtering (default: 5)',
-                    default=5)
+parser.add_argument('-l', '--length', type=int, nargs='+',
+                    help='Minimum length threshold for sequence filtering (default: 200), several values with --sweep',
+                    default=[200])
+parser.add_argument('-c', '--coverage', type=int, nargs='+',
+                    help='Minimum coverage threshold for sequence filtering (default: 5), several values with --sweep',
+                    default=[5])
+parser.add_argument('-x', '--index', action='store_true',
+                    help='Filter by headers only, records are copied without decoding (index is cached next to input)')
+parser.add_argument('-s', '--sweep', action='store_true',
+                    help='Report retained length, sequences and average coverage for all -l/-c combinations')
+parser.add_argument('-I', '--incremental', action='store_true',
+                    help='Reuse results of unchanged assemblies from the manifest in the output directory')
+
+
+def indexed_filter(input_file, output_file, min_len, min_cov):
+    # Pass one: headers and byte ranges of records (cached), pass two: copy byte ranges of passing records
+    total_coverage, total_length = 0.0, 0.0
+    passed_ranges = []
+    for header, record_start, record_end in load_header_index(input_file):
+        _, _, _, length, _, cov, *args = header.split("_")
+        length, cov = float(length), float(cov)
+
+        if length >= min_len and cov >= min_cov:
+            passed_ranges.append((record_start, record_end))
+            total_coverage = total_coverage + (length * cov)
+            total_length = total_length + length
+
+    with open(output_file, 'wb') as outfile:
+        copy_records(input_file, passed_ranges, outfile)
+
+    return total_coverage, total_length
+
+
+def streamed_filter(input_file, output_file, min_len, min_cov):
+    # Records are decoded one by one and written to the output as a single line sequence
+    total_coverage, total_length = 0.0, 0.0
+    with open(output_file, 'w+') as outfile:
+
+        # Stream records of the input file, only the current one is kept in memory
+        for header, sequence in fasta_records(input_file):
+
+            # Extract length and coverage information from header
+            if header.startswith(">"):
+                _, _, _, length, _, cov, *args = header.split("_")
+                length, cov = float(length), float(cov)
+
+                # Filter sequences based on length and coverage criteria
+                if length >= min_len and cov >= min_cov:
+                    outfile.write(f"{header}\n{sequence}\n")
+                    total_coverage = total_coverage + (length * cov)
+                    total_length = total_length + length
+
+    return total_coverage, total_length
+
+
+def custom_fasta_path(input_file, output_path):
+    # {output_path}/{name}_custom.fasta for {input_path}/{name}.fasta
+    return f"{output_path}/{'.'.join(input_file.name.split('.')[0:-1])}_custom.fasta"
+
+
+def assembly_filter(input_file, output_path, min_len, min_cov, use_index):
+    # Filter one assembly, return total coverage and total length of the passed sequences
+    output_file = custom_fasta_path(input_file, output_path)
+    if use_index:
+        return indexed_filter(input_file, output_file, min_len, min_cov)
+    return streamed_filter(input_file, output_file, min_len, min_cov)
+
+
+def threshold_sweep(lengths, coverages, min_lens, min_covs):
+    """
+    Retained length, number of sequences and total coverage (sum of length x cov) for every threshold combination:
+        {(min_len, min_cov): (retained length, retained sequences, total coverage), ...}
+    Sequences are sorted by length once, then for each length threshold the passing ones are sorted by coverage,
+    so all coverage thresholds are answered by binary search in cumulative sums from the highest coverage
+    """
+    length_order = np.argsort(lengths, kind='stable')
+    lengths, coverages = lengths[length_order], coverages[length_order]
+
+    sweep_grid = {}
+    for min_len in min_lens:
+        first_passed = np.searchsorted(lengths, min_len, side='left')
+        passed_lengths, passed_coverages = lengths[first_passed:], coverages[first_passed:]
+
+        coverage_order = np.argsort(passed_coverages, kind='stable')
+        passed_lengths, passed_coverages = passed_lengths[coverage_order], passed_coverages[coverage_order]
+
+        retained_lengths = np.concatenate(([0.0], np.cumsum(passed_lengths[::-1])))
+        total_coverages = np.concatenate(([0.0], np.cumsum((passed_lengths * passed_coverages)[::-1])))
+
+        for min_cov in min_covs:
+            retained = len(passed_coverages) - int(np.searchsorted(passed_coverages, min_cov, side='left'))
+            sweep_grid[(min_len, min_cov)] = (retained_lengths[retained], retained, total_coverages[retained])
+
+    return sweep_grid
+
+
+def sweep_report(input_path, output_path, input_files, min_lens, min_covs):
+    # Each assembly is read once (headers only), all combinations are written to a single table
+    with open(f'{output_path}/threshold_sweep.md', 'w') as sweep_outfile:
+
+        # Templates for lines
+        sweep_outfile.write(('|{:^98}' + '|{:^28}' * 5 + '|\n').format(
+            'Assembly name', 'Minimum length', 'Minimum coverage', 'Retained length', 'Retained sequences',
+            'Average Coverage'))
+        sweep_outfile.write(('|:{:^96}:' + '|:{:^26}:' * 5 + '|\n').format('-' * 96, *['-' * 26] * 5))
+
+        for input_file in input_files:
+            lengths, coverages = [], []
+            for header, _, _ in load_header_index(f'{input_path}/{input_file}'):
+                _, _, _, length, _, cov, *args = header.split("_")
+                lengths.append(float(length))
+                coverages.append(float(cov))
+
+            sweep_grid = threshold_sweep(np.array(lengths), np.array(coverages), min_lens, min_covs)
+            for (min_len, min_cov), (total_length, retained, total_coverage) in sorted(sweep_grid.items()):
+                average_coverage = round((total_coverage / total_length), 2) if total_length else 'N/A'
+                sweep_outfile.write(('|{:^98}' + '|{:^28}' * 5 + '|\n').format(
+                    input_file, min_len, min_cov, int(total_length), retained, average_coverage))
 
 
 def main():
@@ -33,71 +160,62 @@ def main():
     try:
         args = parser.parse_args()
         input_path, output_path = args.input.rstrip('/'), args.output.rstrip('/')
-        min_len, min_cov = args.length, args.coverage
+        min_lens, min_covs, use_index, sweep = args.length, args.coverage, args.index, args.sweep
+        incremental = args.incremental
+        if not sweep and (len(min_lens) > 1 or len(min_covs) > 1):
+            raise ArgumentError(None, 'several length or coverage thresholds require --sweep')
+        min_len, min_cov = min_lens[0], min_covs[0]
 
     except ArgumentError as e:
         print(f"Error: {e}")
         parser.print_help()
         exit(1)
 
-    for input_file in os.listdir(input_path):
-        if (
-                os.path.isfile(os.path.join(input_path, input_file))
-                and input_file.split('.')[-1] == 'fasta'
-        ):
-
-            # Open input file and read lines into list
-            with open(f'{input_path}/{input_file}', 'r') as handle:
-                lines = handle.readlines()
-
-            # Create defaultdict to store sequences keyed by header
-            sequences = defaultdict(list)
-            for line in lines:
-                if line.startswith(">"):
-                    header = line.strip()
-                else:
-                    sequences[header].append(line.strip())
-
-            # Open output file and write filtered sequences, calculate total coverage and total length
-            #                    total coverage     ((len(0) x cov(0)) + ((len(1) x cov(1)) + ... + ((len(n) x cov(n))
-            # Average Coverage = --------------- = --------------------------------------------------------------------
-            #                     total length                      len(0) + len(1) + ... + len(n)
-
-            total_coverage, total_length = 0.0, 0.0
-            with open(f"{output_path}/{'.'.join(input_file.split('.')[0:-1]).split('/')[-1]}_custom.fasta", 'w+') \
-                    as outfile:
-
-                for header in sequences.keys():
-
-                    # Extract length and coverage information from header
-                    if header.startswith(">"):
-                        _, _, _, length, _, cov, *args = header.split("_")
-                        length, cov = float(length), float(cov)
-
-                        # Filter sequences based on length and coverage criteria
-                        if length >= min_len and cov >= min_cov:
-                            outfile.write(f"{header}\n{''.join(sequences[header])}\n")
-                            total_coverage = total_coverage + (length * cov)
-                            total_length = total_length + length
-
-            # Calculate average coverage into separate file
-            average_coverage = round((total_coverage / total_length), 2)
-
-            with open(f'{output_path}/average_coverage.md', 'a+') as cov_outfile:
-
-                # Templates for lines
-                header = '|{:^98}|{:^28}|\n'.format('Assembly name', 'Average Coverage')
-                empty_line_header = '|:{:^96}:|:{:^26}:|\n'.format('-' * 96, '-' * 26)
-                output_line = '|{:^98}|{:^28}|\n'.format(
-                    f"{'.'.join(input_file.split('.')[0:-1]).split('/')[-1]}_custom.fasta", average_coverage)
-
-                # Create header in case of new file
-                if cov_outfile.tell() == 0:
-                    cov_outfile.write(header)
-                    cov_outfile.write(empty_line_header)
-
-                # Add average coverage result to the relevant assembly
-                cov_outfile.write(output_line)
+    # Files are sorted, so rows of reused and newly filtered assemblies are reported in the same order on every run
+    input_files = sorted(input_file for input_file in os.listdir(input_path)
+                         if os.path.isfile(os.path.join(input_path, input_file))
+                         and input_file.split('.')[-1] == 'fasta')
+
+    if sweep:
+        sweep_report(input_path, output_path, input_files, sorted(set(min_lens)), sorted(set(min_covs)))
+        return
+
+    # Results of assemblies unchanged since the previous run with the same thresholds are reused
+    manifest = load_manifest(output_path, 'NCBI_assembly_filter_mod') if incremental else None
+    parameters = {'length': min_len, 'coverage': min_cov, 'index': use_index}
+
+    file_results = incremental_map(
+        assembly_filter, 1, [Path(input_path, input_file) for input_file in input_files],
+        (output_path, min_len, min_cov, use_index), manifest, parameters,
+        lambda input_file: [custom_fasta_path(input_file, output_path)])
+
+    # Filter each assembly, calculate total coverage and total length
+    #                    total coverage     ((len(0) x cov(0)) + ((len(1) x cov(1)) + ... + ((len(n) x cov(n))
+    # Average Coverage = --------------- = --------------------------------------------------------------------
+    #                     total length                      len(0) + len(1) + ... + len(n)
+    # All assemblies are filtered before the report is written, a failed run keeps the previous report
+    report_lines = []
+    for input_file, (total_coverage, total_length) in zip(input_files, file_results):
+        # Calculate average coverage of the assembly (N/A if no sequence passed the filter)
+        average_coverage = round((total_coverage / total_length), 2) if total_length else 'N/A'
+        report_lines.append('|{:^98}|{:^28}|\n'.format(
+            f"{'.'.join(input_file.split('.')[0:-1]).split('/')[-1]}_custom.fasta", average_coverage))
+
+    # The report is rebuilt on every run (one header, one row per assembly, also for reused results) in a temporary
+    # file first, so an interrupted run never leaves a truncated report
+    report_file = f'{output_path}/average_coverage.md'
+    with open(f'{report_file}.tmp', 'w') as cov_outfile:
+
+        # Templates for lines
+        cov_outfile.write('|{:^98}|{:^28}|\n'.format('Assembly name', 'Average Coverage'))
+        cov_outfile.write('|:{:^96}:|:{:^26}:|\n'.format('-' * 96, '-' * 26))
+
+        # Add average coverage results of the assemblies
+        cov_outfile.writelines(report_lines)
+    os.replace(f'{report_file}.tmp', report_file)
+
+    if incremental:
+        save_manifest(manifest, output_path, 'NCBI_assembly_filter_mod')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,148 @@
+from argparse import ArgumentParser, RawTextHelpFormatter, ArgumentError, ArgumentTypeError
+from pathlib import Path
+
+import numpy as np
+
+desc = "Script generates seeded synthetic Geneious-style alignments (CONTIGS output) for benchmarks of " \
+       "consensus_generator.py, geneious_consensus_filter.py and sequence_cleaner.py.\n" \
+       "Each file has the Primary (assembly, '?' flanks) and ENHANCERS reads aligned to the same random reference:\n" \
+       "    >synthetic_{file}_reflen_{LENGTH}_primary\n" \
+       "    >synthetic_{file}_read_{enhancer}_reflen_{LENGTH}\n" \
+       "Reads cover random parts of the alignment, GAP_DENSITY of positions are in gap runs and AMBIGUITY of " \
+       "positions are IUPAC ambiguous codes (N included). The same SEED gives byte for byte identical files.\n\n" \
+       "└OUTPUT_DIRECTORY (exists or will be created)\n" \
+       "   ├ synthetic_0.fasta (will be created/overwritten)\n" \
+       "   └ synthetic_{FILES - 1}.fasta (will be created/overwritten)"
+
+usage = "python3 <script_name>.py [-h] -o OUTPUT [-n FILES] [-l LENGTH] [-e ENHANCERS] [-g GAP_DENSITY]\n" \
+        "                         [-a AMBIGUITY] [-R] [-s SEED]\n\n" \
+        "Options:\n" \
+        "-o, --output            Output directory path\n" \
+        "-n, --files             Number of alignments (default: 4)\n" \
+        "-l, --length            Alignment length (default: 100000)\n" \
+        "-e, --enhancers         Number of enhancers per alignment (default: 8)\n" \
+        "-g, --gap_density       Fraction of positions in gap runs (default: 0.05)\n" \
+        "-a, --ambiguity         Fraction of IUPAC ambiguous positions (default: 0.02)\n" \
+        "-R, --no_reflen         Headers without _reflen_LENGTH_\n" \
+        "-s, --seed              Random seed (default: 0)"
+
+# Mean length of gap runs, Primary flanks of '?' are up to this fraction of the alignment
+GAP_RUN_LENGTH = 20
+UNKNOWN_FLANK = 0.01
+# Line width of the generated FASTA (Geneious wraps sequences)
+LINE_WIDTH = 60
+
+NUCLEOTIDES = np.frombuffer(b'ATGC', dtype=np.uint8)
+AMBIGUOUS = np.frombuffer(b'RYMKSWHBVDN', dtype=np.uint8)
+
+
+def data_arguments(parser):
+    # Options of the synthetic data, shared with benchmark.py
+    parser.add_argument('-n', '--files', type=int, help='Number of alignments (default: 4)', default=4)
+    parser.add_argument('-l', '--length', type=int, help='Alignment length (default: 100000)', default=100000)
+    parser.add_argument('-e', '--enhancers', type=int, help='Number of enhancers per alignment (default: 8)',
+                        default=8)
+    parser.add_argument('-g', '--gap_density', type=float, help='Fraction of positions in gap runs (default: 0.05)',
+                        default=0.05)
+    parser.add_argument('-a', '--ambiguity', type=float, help='Fraction of IUPAC ambiguous positions (default: 0.02)',
+                        default=0.02)
+    parser.add_argument('-R', '--no_reflen', action='store_true', help='Headers without _reflen_LENGTH_')
+    parser.add_argument('-s', '--seed', type=int, help='Random seed (default: 0)', default=0)
+
+
+def data_parameters(args):
+    # Validated options of the synthetic data as a dict (keys are generate_alignments arguments)
+    if args.files < 1 or args.length < 1 or args.enhancers < 0:
+        raise ArgumentTypeError('FILES and LENGTH should be positive, ENHANCERS should not be negative')
+    if not 0 <= args.gap_density < 1 or not 0 <= args.ambiguity < 1 or args.gap_density + args.ambiguity >= 1:
+        raise ArgumentTypeError('GAP_DENSITY and AMBIGUITY should be fractions with the sum below 1')
+
+    return {'files': args.files, 'length': args.length, 'enhancers': args.enhancers, 'gap_density': args.gap_density,
+            'ambiguity': args.ambiguity, 'reflen': not args.no_reflen, 'seed': args.seed}
+
+
+parser = ArgumentParser(description=desc, formatter_class=RawTextHelpFormatter, usage=usage)
+parser.add_argument('-o', '--output', type=str, help='Output directory path', required=True)
+data_arguments(parser)
+
+
+def initialization():
+    try:
+        args = parser.parse_args()
+
+        # Required
+        output_path: Path = Path(args.output).resolve()
+
+        # Optional
+        parameters = data_parameters(args)
+
+        return output_path, parameters
+
+    except (ArgumentError, ArgumentTypeError) as e:
+        print(f'Check help! Error: {e}')
+        exit(1)
+
+
+def aligned_row(rng, reference, gap_density, ambiguity, covered_start, covered_end):
+    # Reference copy with ambiguous codes and gap runs, positions outside covered_start..covered_end - 1 are gaps
+    length = len(reference)
+    row = reference.copy()
+
+    ambiguous = rng.random(length) < ambiguity
+    row[ambiguous] = rng.choice(AMBIGUOUS, size=int(ambiguous.sum()))
+
+    for gap_start in rng.integers(0, length, size=int(gap_density * length / GAP_RUN_LENGTH)):
+        row[gap_start:gap_start + rng.geometric(1 / GAP_RUN_LENGTH)] = ord('-')
+
+    row[:covered_start] = ord('-')
+    row[covered_end:] = ord('-')
+    return row
+
+
+def write_record(outfile, header, row):
+    outfile.write(f'>{header}\n'.encode())
+    outfile.write(b'\n'.join(row[i:i + LINE_WIDTH].tobytes() for i in range(0, len(row), LINE_WIDTH)) + b'\n')
+
+
+def generate_alignments(output_path, files, length, enhancers, gap_density, ambiguity, reflen, seed):
+    # Write synthetic_{index}.fasta files to output_path and return their paths
+    output_path.mkdir(parents=True, exist_ok=True)
+    reflen_tag = f'_reflen_{length}' if reflen else ''
+
+    alignment_files = []
+    for file_index in range(files):
+        # Every file has its own stream, so a file doesn't depend on the number of files
+        rng = np.random.default_rng([seed, file_index])
+        reference = rng.choice(NUCLEOTIDES, size=length)
+        alignment_file = output_path / f'synthetic_{file_index}.fasta'
+
+        with open(alignment_file, 'wb') as outfile:
+            # Primary covers the whole alignment with '?' flanks
+            primary = aligned_row(rng, reference, gap_density, ambiguity, 0, length)
+            flank = int(length * UNKNOWN_FLANK)
+            primary[:rng.integers(0, flank + 1)] = ord('?')
+            primary[length - rng.integers(0, flank + 1):] = ord('?')
+            write_record(outfile, f'synthetic_{file_index}{reflen_tag}_primary', primary)
+
+            # Reads to the reference cover at least a half of the alignment
+            for enhancer in range(enhancers):
+                covered_start = int(rng.integers(0, length // 4 + 1))
+                covered_end = length - int(rng.integers(0, length // 4 + 1))
+                row = aligned_row(rng, reference, gap_density, ambiguity, covered_start, covered_end)
+                write_record(outfile, f'synthetic_{file_index}_read_{enhancer}{reflen_tag}', row)
+
+        alignment_files.append(alignment_file)
+
+    return alignment_files
+
+
+def main():
+    output_path, parameters = initialization()
+
+    generate_alignments(output_path, **parameters)
+
+    print("Successful run!")  # For logging purposes
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+from argparse import ArgumentParser, RawTextHelpFormatter, ArgumentError, ArgumentTypeError
+from datetime import datetime
+from pathlib import Path
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+from alignment_generator import data_arguments, data_parameters, generate_alignments
+
+desc = "Script benchmarks consensus_generator.py (column and matrix engines), geneious_consensus_filter.py and " \
+       "sequence_cleaner.py on seeded synthetic Geneious-style alignments (see alignment_generator.py).\n" \
+       "Every script is run REPEAT times as a separate process on the same data, the fastest run is reported:\n" \
+       "    columns/sec     alignment columns (FILES x LENGTH) processed per second\n" \
+       "    MB/sec          input FASTA megabytes processed per second\n" \
+       "    peak RSS        maximal resident memory of the script process (MB)\n" \
+       "Results are saved to JSON, a previous JSON can be compared with the current run (-c).\n\n" \
+       "└OUTPUT_DIRECTORY (exists or will be created)\n" \
+       "   ├ alignments/            synthetic input (will be created/overwritten)\n" \
+       "   ├ runs/{script}/         output and log of the last run of the script (will be created/overwritten)\n" \
+       "   └ benchmark.json         results (will be created/overwritten, see -j)"
+
+usage = "python3 <script_name>.py [-h] -o OUTPUT [-r REPEAT] [-S SCRIPTS ...] [-j JSON] [-c COMPARE]\n" \
+        "                         [-n FILES] [-l LENGTH] [-e ENHANCERS] [-g GAP_DENSITY] [-a AMBIGUITY] [-R]\n" \
+        "                         [-s SEED]\n\n" \
+        "Options:\n" \
+        "-o, --output            Output directory path\n" \
+        "-r, --repeat            Runs per script, the fastest one is reported (default: 3)\n" \
+        "-S, --scripts           Benchmarked scripts (default: all)\n" \
+        "-j, --json              Results file (default: OUTPUT/benchmark.json)\n" \
+        "-c, --compare           Results file of a previous run to compare with\n" \
+        "-n, --files             Number of alignments (default: 4)\n" \
+        "-l, --length            Alignment length (default: 100000)\n" \
+        "-e, --enhancers         Number of enhancers per alignment (default: 8)\n" \
+        "-g, --gap_density       Fraction of positions in gap runs (default: 0.05)\n" \
+        "-a, --ambiguity         Fraction of IUPAC ambiguous positions (default: 0.02)\n" \
+        "-R, --no_reflen         Headers without _reflen_LENGTH_\n" \
+        "-s, --seed              Random seed (default: 0)"
+
+SCRIPTS_PATH = Path(__file__).resolve().parents[1]
+# Benchmarked commands: name -> (script, arguments besides input and output)
+BENCHMARKS = {
+    'consensus_generator_column': (SCRIPTS_PATH / 'consensus_generator' / 'consensus_generator.py', ['-e', 'column']),
+    'consensus_generator_matrix': (SCRIPTS_PATH / 'consensus_generator' / 'consensus_generator.py', ['-e', 'matrix']),
+    'geneious_consensus_filter': (SCRIPTS_PATH / 'geneious_consensus_reference_length_filter' /
+                                  'geneious_consensus_filter.py', []),
+    'sequence_cleaner': (SCRIPTS_PATH / 'sequence_cleaner' / 'sequence_cleaner.py', [])
+}
+
+parser = ArgumentParser(description=desc, formatter_class=RawTextHelpFormatter, usage=usage)
+parser.add_argument('-o', '--output', type=str, help='Output directory path', required=True)
+parser.add_argument('-r', '--repeat', type=int, help='Runs per script, the fastest one is reported (default: 3)',
+                    default=3)
+parser.add_argument('-S', '--scripts', type=str, nargs='+', choices=list(BENCHMARKS), help='Benchmarked scripts',
+                    default=list(BENCHMARKS))
+parser.add_argument('-j', '--json', type=str, help='Results file (default: OUTPUT/benchmark.json)')
+parser.add_argument('-c', '--compare', type=str, help='Results file of a previous run to compare with')
+data_arguments(parser)
+
+
+def initialization():
+    try:
+        args = parser.parse_args()
+
+        # Required
+        output_path: Path = Path(args.output).resolve()
+
+        # Optional
+        repeat: int = args.repeat
+        if repeat < 1:
+            raise ArgumentTypeError(f'Number of runs should be at least 1, got {repeat}')
+        scripts: list = list(dict.fromkeys(args.scripts))
+        json_file: Path = Path(args.json).resolve() if args.json else output_path / 'benchmark.json'
+        compare_file = Path(args.compare).resolve() if args.compare else None
+        parameters = data_parameters(args)
+
+        return output_path, repeat, scripts, json_file, compare_file, parameters
+
+    except (ArgumentError, ArgumentTypeError) as e:
+        print(f'Check help! Error: {e}')
+        exit(1)
+
+
+def peak_rss_mb(rusage):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(rusage.ru_maxrss / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 2)
+
+
+def run_script(script, arguments, input_path, run_path):
+    """
+    Run the script once in a new process with a clean output directory, returns (seconds, peak RSS MB, exit code).
+    os.wait4 gives the resource usage of this process only (not the maximum over all finished children)
+    """
+    shutil.rmtree(run_path, ignore_errors=True)
+    run_path.mkdir(parents=True)
+
+    with open(f'{run_path}.log', 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, str(script), '-i', str(input_path), '-o', str(run_path),
+                                    *arguments], stdout=log, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    return seconds, peak_rss_mb(rusage), process.returncode
+
+
+def benchmark_script(name, repeat, input_path, output_path, columns, input_mb):
+    script, arguments = BENCHMARKS[name]
+    runs = []
+    for _ in range(repeat):
+        seconds, peak_rss, exit_code = run_script(script, arguments, input_path, output_path / 'runs' / name)
+        if exit_code:
+            return {'error': f'exit code {exit_code}, see {output_path / "runs" / name}.log'}
+        runs.append({'seconds': round(seconds, 4), 'peak_rss_mb': peak_rss})
+
+    seconds = min(run['seconds'] for run in runs)
+    return {
+        'seconds': seconds,
+        'columns_per_sec': round(columns / seconds, 1),
+        'mb_per_sec': round(input_mb / seconds, 3),
+        'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+        'runs': runs
+    }
+
+
+def comparison_report(results, previous_results):
+    # Markdown table: current value, previous value and change (%) of every metric
+    lines = [('|{:^40}' + '|{:^28}' * 4 + '|\n').format('Script', 'Metric', 'Current', 'Previous', 'Change'),
+             ('|{:^38}' + '|{:^26}' * 4 + '|\n').format(':' + '-' * 38 + ':', *[':' + '-' * 26 + ':'] * 4)]
+    for name, result in results.items():
+        previous = previous_results.get(name, {})
+        for metric in ('columns_per_sec', 'mb_per_sec', 'peak_rss_mb'):
+            if metric not in result or metric not in previous:
+                continue
+            change = (result[metric] - previous[metric]) / previous[metric] * 100 if previous[metric] else 0
+            lines.append(('|{:^40}' + '|{:^28}' * 4 + '|\n').format(name, metric, result[metric], previous[metric],
+                                                                   f'{change:+.1f}%'))
+    return ''.join(lines)
+
+
+def main():
+    output_path, repeat, scripts, json_file, compare_file, parameters = initialization()
+
+    # Previous results are read first, they may be in the same file as the current ones
+    previous = None
+    if compare_file is not None:
+        with open(compare_file, 'r') as handle:
+            previous = json.load(handle)
+
+    input_path = output_path / 'alignments'
+    shutil.rmtree(input_path, ignore_errors=True)
+    alignment_files = generate_alignments(input_path, **parameters)
+
+    columns = parameters['files'] * parameters['length']
+    input_mb = sum(alignment_file.stat().st_size for alignment_file in alignment_files) / (1 << 20)
+
+    results = {name: benchmark_script(name, repeat, input_path, output_path, columns, input_mb) for name in scripts}
+
+    benchmark = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {**parameters, 'repeat': repeat, 'input_mb': round(input_mb, 3)},
+        'results': results
+    }
+    json_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(json_file, 'w') as outfile:
+        json.dump(benchmark, outfile, indent=2)
+
+    if previous is not None:
+        if previous['parameters'] != benchmark['parameters']:
+            print('Warning: compared benchmarks have different parameters')
+        print(comparison_report(results, previous['results']))
+
+    # Results of all scripts are saved, but the run fails if any of them failed
+    failed = {name: result['error'] for name, result in results.items() if 'error' in result}
+    if failed:
+        for name, error in failed.items():
+            print(f'Error: {name} failed with {error}')
+        exit(1)
+
+    print("Successful run!")  # For logging purposes
+
+
+if __name__ == '__main__':
+    main()
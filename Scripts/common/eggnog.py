@@ -0,0 +1,171 @@
+"""
+Loader of eggNOG-mapper v2 .emapper.annotations files shared by the emap scripts.
+Annotations start with '##' run information lines and the '#query ...' header and end with '##' statistics lines,
+columns used by the scripts (0-based positions of the tab-separated table):
+    query           0       query (gene) name
+    eggNOG_OGs      4       orthologous groups, e.g. COG0001@1|root,COG0001@2|Bacteria,4HA6E@91061|Bacilli
+    max_annot_lvl   5       taxonomic level of the annotation
+    COG_category    6       COG functional category (one or more letters, '-' for none)
+Derived columns are computed per file before the files are combined:
+    taxonomic_group         taxonomic group of the narrowest orthologous group (Bacilli above), NaN without groups
+Files are parsed with pandas, except when only derived columns are requested: then lines are split in bytes up to the
+eggNOG_OGs column and every distinct group tail is resolved once per file
+All files are combined into one long table with a categorical 'sample' column and categorical annotation columns
+"""
+import csv
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+ANNOTATIONS_SUFFIX = '.emapper.annotations'
+ANNOTATION_COLUMNS = {'query': 0, 'eggNOG_OGs': 4, 'max_annot_lvl': 5, 'COG_category': 6}
+# Derived column -> annotation column it is computed from
+DERIVED_COLUMNS = {'taxonomic_group': 'eggNOG_OGs'}
+
+
+def annotation_files(input_dir: Union[str, Path], suffix: str = ANNOTATIONS_SUFFIX,
+                     recursive: bool = False) -> List[Path]:
+    # Annotation files of the directory (and its subdirectories if recursive) sorted by name
+    files = Path(input_dir).rglob(f'*{suffix}') if recursive else Path(input_dir).glob(f'*{suffix}')
+    return sorted((file for file in files if file.is_file()), key=lambda file: file.name)
+
+
+def sample_name(file: Union[str, Path]) -> str:
+    # Sample name of the annotation file: sample.emapper.annotations -> sample
+    name = Path(file).name
+    return name[:-len(ANNOTATIONS_SUFFIX)] if name.endswith(ANNOTATIONS_SUFFIX) else name.split('.')[0]
+
+
+def taxonomic_group(orthologous_groups: str) -> Optional[str]:
+    # Name of the last (narrowest) group, '...,1TP0@1239|Bacilli' -> 'Bacilli', None for '-'
+    if '@' not in orthologous_groups:
+        return None
+    fields = orthologous_groups.rsplit('@', 1)[1].split('|', 2)
+    return fields[1] if len(fields) > 1 else None
+
+
+def taxonomic_groups(orthologous_groups: pd.Series) -> pd.Series:
+    # taxonomic_group of every value, one str method pass per value instead of chained .str accessors
+    return pd.Series(map(taxonomic_group, orthologous_groups.tolist()), index=orthologous_groups.index, dtype=object)
+
+
+def _comment_lines(file: Union[str, Path]) -> int:
+    # Number of leading comment lines ('##' information and the '#query' header)
+    lines = 0
+    with open(file, 'rb') as handle:
+        for line in handle:
+            if not line.startswith(b'#'):
+                break
+            lines += 1
+    return lines
+
+
+def _read_taxonomic_groups(file: Union[str, Path]) -> pd.Categorical:
+    """
+    taxonomic_group of every query of one annotation file without pandas parsing: data lines are split only up to
+    the eggNOG_OGs column, the text from its last '@' ('@1239|Bacilli') is coded per line, and taxonomic_group runs
+    once per distinct code (orthologous groups are mostly unique, their last groups are not)
+    """
+    column = ANNOTATION_COLUMNS['eggNOG_OGs']
+    with open(file, 'rb') as handle:
+        lines = [line for line in handle.read().splitlines() if line and not line.startswith(b'#')]
+
+    tails = {}
+    codes = []
+    for line in lines:
+        fields = line.split(b'\t', column + 1)
+        orthologous_groups = fields[column] if len(fields) > column else b''
+        # Without '@' the tail is the last character, which taxonomic_group maps to None
+        codes.append(tails.setdefault(orthologous_groups[orthologous_groups.rfind(b'@'):], len(tails)))
+
+    groups = [taxonomic_group(tail.decode()) for tail in tails]
+    categories = sorted({group for group in groups if group is not None})
+    category_codes = {group: code for code, group in enumerate(categories)}
+    group_codes = np.array([category_codes.get(group, -1) for group in groups], dtype=np.int64)
+    return pd.Categorical.from_codes(group_codes[np.array(codes, dtype=np.int64)],
+                                     categories=pd.Index(categories, dtype=str))
+
+
+def read_annotations(file: Union[str, Path], columns: Sequence[str]) -> pd.DataFrame:
+    """
+    Requested columns (names of ANNOTATION_COLUMNS or DERIVED_COLUMNS) of one annotation file as strings,
+    only the needed columns are parsed, comment lines are skipped wherever they are.
+    taxonomic_group alone is read by the byte-level parser as a categorical
+    """
+    unknown_columns = set(columns) - set(ANNOTATION_COLUMNS) - set(DERIVED_COLUMNS)
+    if unknown_columns:
+        raise KeyError(f'Unknown annotation columns: {", ".join(sorted(unknown_columns))}')
+    if list(columns) == ['taxonomic_group']:
+        return pd.DataFrame({'taxonomic_group': _read_taxonomic_groups(file)})
+
+    parsed = ['query'] + [DERIVED_COLUMNS.get(column, column) for column in columns]
+    parsed = sorted(set(parsed), key=ANNOTATION_COLUMNS.get)
+    try:
+        annotations = pd.read_csv(file, sep='\t', header=None, skiprows=_comment_lines(file), dtype=str,
+                                  usecols=[ANNOTATION_COLUMNS[column] for column in parsed],
+                                  quoting=csv.QUOTE_NONE, na_filter=False)
+        annotations.columns = parsed
+    except pd.errors.EmptyDataError:
+        annotations = pd.DataFrame({column: pd.Series(dtype=str) for column in parsed})
+
+    # Trailing '##' statistics lines are rows with the comment in the query column
+    annotations = annotations[~annotations['query'].str.startswith('#')]
+    for column in columns:
+        if column in DERIVED_COLUMNS:
+            annotations[column] = taxonomic_groups(annotations[DERIVED_COLUMNS[column]])
+    return annotations[list(columns)].reset_index(drop=True)
+
+
+def _combined_column(tables: List[pd.DataFrame], column: str) -> Union[pd.Series, pd.Categorical]:
+    # Column of all tables, categoricals (byte-level parser) are merged by their codes, strings are concatenated
+    values = [table[column] for table in tables]
+    if not values:
+        return pd.Series(dtype=str)
+    if all(isinstance(value.dtype, pd.CategoricalDtype) for value in values):
+        return union_categoricals(values, sort_categories=True)
+    return pd.concat(values, ignore_index=True)
+
+
+def load_annotations(files: Iterable[Union[str, Path]], columns: Sequence[str] = ('COG_category',)) -> pd.DataFrame:
+    """
+    Long table of all annotation files: 'sample' and the requested columns, one row per annotated query.
+    Samples are categories in the order of files, annotation values are sorted categories:
+        pd.crosstab(annotations['COG_category'], annotations['sample']) -> COG categories x samples counts
+    """
+    files = list(files)
+    samples = pd.Index([sample_name(file) for file in files])
+    tables = [read_annotations(file, columns) for file in files]
+
+    annotations = pd.DataFrame({column: _combined_column(tables, column) for column in columns})
+    # Sample of every row from the row counts of the files (files of the same sample share the category)
+    categories = samples.unique()
+    codes = np.repeat(categories.get_indexer(samples), [len(table) for table in tables])
+    annotations.insert(0, 'sample', pd.Categorical.from_codes(codes, categories=categories))
+    for column in columns:
+        annotations[column] = annotations[column].astype('category')
+    return annotations
+
+
+def file_counts(file: Union[str, Path], column: str) -> List[Tuple[str, int]]:
+    # Number of queries with every value of the column in one annotation file as (value, count) pairs in the order
+    # the values first appear (a list keeps the order in JSON manifests, their keys are sorted)
+    values = read_annotations(file, (column,))[column]
+    return [(value, int(count)) for value, count in values.value_counts(sort=False).items()]
+
+
+def counts_table(samples: Iterable[str], counts: Iterable[Sequence[Tuple[str, int]]]) -> pd.DataFrame:
+    # Values (rows, in the order they first appear in the files) x samples (sorted columns) table of file_counts
+    # results, files of the same sample are summed
+    table = pd.DataFrame([pd.Series(dict(file_count), name=sample, dtype=np.int64)
+                          for sample, file_count in zip(samples, counts)])
+    table = table.groupby(level=0).sum() if table.index.has_duplicates else table
+    return table.T.fillna(0).astype(np.int64).sort_index(axis=1)
+
+
+def sample_counts(annotations: pd.DataFrame, column: str) -> pd.DataFrame:
+    # Number of queries with every value of the column (columns) in every sample (rows, samples without them included)
+    counts = pd.crosstab(annotations['sample'], annotations[column])
+    return counts.reindex(annotations['sample'].cat.categories, fill_value=0).rename_axis(index=None, columns=None)
@@ -0,0 +1,140 @@
+import os
+from mmap import mmap, ACCESS_READ
+from pathlib import Path
+from typing import BinaryIO, Iterable, List, Tuple, Union
+
+# Suffix of the cached header index, stored next to the indexed FASTA file (scaffolds.fasta => scaffolds.fasta.hdx)
+INDEX_SUFFIX = '.hdx'
+# Chunk size for copying records' byte ranges (1 MiB)
+COPY_CHUNK_SIZE = 1 << 20
+
+
+def _file_signature(file: Union[str, Path]) -> str:
+    # Index is valid only for the same size and modification time of the FASTA file
+    stat = os.stat(file)
+    return f'#{stat.st_size}\t{stat.st_mtime_ns}'
+
+
+def build_header_index(file: Union[str, Path]) -> List[Tuple[str, int, int]]:
+    """
+    Scan only headers of the FASTA file (sequences are not decoded) and return records' byte ranges:
+        [(header, record start, record end), ...]      header is the stripped header line (with '>'),
+                                                         record end is the start of the next record or EOF
+    """
+    if os.path.getsize(file) == 0:
+        return []
+
+    records = []
+    with open(file, 'rb') as handle, mmap(handle.fileno(), 0, access=ACCESS_READ) as data:
+        record_starts = [0] if data[:1] == b'>' else []
+        position = data.find(b'\n>')
+        while position != -1:
+            record_starts.append(position + 1)
+            position = data.find(b'\n>', position + 1)
+
+        record_ends = record_starts[1:] + [len(data)]
+        for record_start, record_end in zip(record_starts, record_ends):
+            header_end = data.find(b'\n', record_start, record_end)
+            header = data[record_start:header_end if header_end != -1 else record_end]
+            records.append((header.decode().strip(), record_start, record_end))
+
+    return records
+
+
+def load_header_index(file: Union[str, Path]) -> List[Tuple[str, int, int]]:
+    """
+    Return the header index of the FASTA file, reusing {file}.hdx if the file hasn't changed since it was written.
+    A new index is cached next to the input when possible (read-only directories are indexed without caching)
+    """
+    index_file, signature = f'{file}{INDEX_SUFFIX}', _file_signature(file)
+
+    if os.path.isfile(index_file):
+        with open(index_file, 'r') as handle:
+            if handle.readline().rstrip('\n') == signature:
+                records = []
+                for line in handle:
+                    header, record_start, record_end = line.rstrip('\n').rsplit('\t', 2)
+                    records.append((header, int(record_start), int(record_end)))
+                return records
+
+    records = build_header_index(file)
+    try:
+        with open(index_file, 'w') as handle:
+            handle.write(f'{signature}\n')
+            for header, record_start, record_end in records:
+                handle.write(f'{header}\t{record_start}\t{record_end}\n')
+    except OSError:
+        pass
+
+    return records
+
+
+def copy_records(file: Union[str, Path], byte_ranges: Iterable[Tuple[int, int]], outfile: BinaryIO) -> None:
+    # Copy records' byte ranges from the FASTA file to the binary outfile without decoding (adjacent ranges are merged)
+    merged_ranges = []
+    for record_start, record_end in byte_ranges:
+        if merged_ranges and merged_ranges[-1][1] == record_start:
+            merged_ranges[-1][1] = record_end
+        else:
+            merged_ranges.append([record_start, record_end])
+
+    with open(file, 'rb') as handle:
+        for record_start, record_end in merged_ranges:
+            handle.seek(record_start)
+            remaining, chunk = record_end - record_start, b''
+            while remaining > 0:
+                chunk = handle.read(min(remaining, COPY_CHUNK_SIZE))
+                if not chunk:
+                    break
+                outfile.write(chunk)
+                remaining -= len(chunk)
+
+            # The last record of the file may have no line break
+            if chunk and not chunk.endswith(b'\n'):
+                outfile.write(b'\n')
+
+
+def build_sequence_layout(file: Union[str, Path]) -> List[Tuple[str, int, int, int, int]]:
+    """
+    .fai-like layout of records for reading sequence regions without loading whole sequences:
+        [(header, sequence offset, sequence length, line bases, line width), ...]
+    All sequence lines of a record except the last one must have the same length (as for samtools faidx)
+    """
+    records = []
+    with open(file, 'rb', buffering=COPY_CHUNK_SIZE) as handle:
+        offset, record, last_line_short = 0, None, False
+        for line in handle:
+            if line.startswith(b'>'):
+                if record is not None:
+                    records.append(tuple(record))
+                record, last_line_short = [line.decode().strip(), offset + len(line), 0, 0, 0], False
+            elif record is not None:
+                line_bases = len(line.rstrip(b'\r\n'))
+                if not record[3]:
+                    # Empty lines before the first sequence line only move the sequence offset
+                    if not line_bases:
+                        record[1] = offset + len(line)
+                    record[3], record[4] = line_bases, len(line)
+                elif (last_line_short and line_bases) or line_bases > record[3]:
+                    raise ValueError(f'Different line lengths inside {record[0]} of {file}')
+                last_line_short = line_bases < record[3]
+                record[2] += line_bases
+            offset += len(line)
+
+        if record is not None:
+            records.append(tuple(record))
+
+    return records
+
+
+def read_sequence_region(handle: BinaryIO, record: Tuple[str, int, int, int, int], start: int, end: int) -> bytes:
+    # Bases start..end - 1 (0-based) of the record from build_sequence_layout, handle is the FASTA opened as 'rb'
+    _, sequence_offset, length, line_bases, line_width = record
+    end = min(end, length)
+    if start >= end:
+        return b''
+
+    first_byte = sequence_offset + (start // line_bases) * line_width + start % line_bases
+    last_byte = sequence_offset + ((end - 1) // line_bases) * line_width + (end - 1) % line_bases
+    handle.seek(first_byte)
+    return handle.read(last_byte - first_byte + 1).replace(b'\n', b'').replace(b'\r', b'')
@@ -0,0 +1,28 @@
+from pathlib import Path
+from typing import Iterator, Tuple, Union
+
+# Read buffer for FASTA files (1 MiB), large enough for multi-gigabyte SPAdes scaffolds
+BUFFER_SIZE = 1 << 20
+
+
+def fasta_records(file: Union[str, Path], buffer_size: int = BUFFER_SIZE) -> Iterator[Tuple[str, str]]:
+    """
+    Stream FASTA records one at a time:
+        >NODE_1_length_700_cov_5.1          =>      ('>NODE_1_length_700_cov_5.1', 'ACGTACGTAC')
+        ACGTA
+        CGTAC
+    Header is the stripped header line (with '>'), sequence is the concatenation of stripped sequence lines.
+    Lines before the first header are ignored. Only the current record is kept in memory.
+    """
+    with open(file, 'r', buffering=buffer_size) as handle:
+        header, sequence_lines = None, []
+        for line in handle:
+            if line.startswith('>'):
+                if header is not None:
+                    yield header, ''.join(sequence_lines)
+                header, sequence_lines = line.strip(), []
+            elif header is not None:
+                sequence_lines.append(line.strip())
+
+        if header is not None:
+            yield header, ''.join(sequence_lines)
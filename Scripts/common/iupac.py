@@ -0,0 +1,61 @@
+"""
+IUPAC nucleotide codec shared by the scripts. 256-entry tables are indexed by the ASCII code of a symbol:
+    MASK_TABLE      symbol -> 4-bit mask of A (1), T (2), G (4), C (8), N = 15, '-' and '?' = 0,
+                    UNKNOWN_MASK for non-IUPAC symbols
+    MASK_ASCII      4-bit mask -> ASCII code of the IUPAC symbol (16 entries, 0 = '-')
+    QUALITY_TABLE   symbol -> quality class: 4 (ATGC), 3 (RYMKSW), 2 (HBVD), 0 (N, '-', '?' and the rest)
+    CATEGORY_TABLE  symbol -> report category (NUCLEOTIDE, TWO_NUCLEOTIDES, ... OTHER)
+IUPAC ambiguous nucleotide codes: R: A or G | Y: C or T | M: A or C | K: G or T | S: C or G | W: A or T |
+H: A or C or T | B: C or G or T | V: A or C or G | D: A or G or T | N: A or C or G or T
+"""
+import numpy as np
+
+# Symbols of the 4-bit masks (A = bit 0, T = bit 1, G = bit 2, C = bit 3)
+MASK_SYMBOLS = '-ATWGRKDCMYHSVBN'
+MASK_ASCII = np.frombuffer(MASK_SYMBOLS.encode(), dtype=np.uint8)
+IUPAC_SYMBOLS = MASK_SYMBOLS + '?'
+
+UNKNOWN_MASK = 255
+MASK_TABLE = np.full(256, UNKNOWN_MASK, dtype=np.uint8)
+for mask, symbol in enumerate(MASK_SYMBOLS):
+    MASK_TABLE[ord(symbol)] = mask
+MASK_TABLE[ord('?')] = 0
+
+QUALITY_TABLE = np.zeros(256, dtype=np.uint8)
+for symbols, quality in {'ATGC': 4, 'RYMKSW': 3, 'HBVD': 2}.items():
+    QUALITY_TABLE[np.frombuffer(symbols.encode(), dtype=np.uint8)] = quality
+
+# Report categories
+NUCLEOTIDE, TWO_NUCLEOTIDES, THREE_NUCLEOTIDES, ANY_NUCLEOTIDE, GAP, UNKNOWN, OTHER = range(7)
+CATEGORY_SYMBOLS = {
+    NUCLEOTIDE: 'ATGC',
+    TWO_NUCLEOTIDES: 'RYMKSW',
+    THREE_NUCLEOTIDES: 'HBVD',
+    ANY_NUCLEOTIDE: 'N',
+    GAP: '-',
+    UNKNOWN: '?'
+}
+CATEGORY_TABLE = np.full(256, OTHER, dtype=np.uint8)
+for category, symbols in CATEGORY_SYMBOLS.items():
+    CATEGORY_TABLE[np.frombuffer(symbols.encode(), dtype=np.uint8)] = category
+
+
+def symbol_histogram(sequence: str) -> np.ndarray:
+    """
+    Count all symbols of the sequence in one pass (numpy.bincount on a uint8 view of the ASCII sequence):
+        histogram = symbol_histogram('ANNAC?')      =>      histogram[ord('N')] == 2, histogram[ord('?')] == 1
+    """
+    return np.bincount(np.frombuffer(sequence.encode(), dtype=np.uint8), minlength=256)
+
+
+def symbols_count(histogram: np.ndarray, symbols: str) -> int:
+    # Total number of the SYMBOLS (repeated symbols are counted once) in the symbol_histogram of a sequence
+    return int(histogram[np.frombuffer(''.join(set(symbols)).encode(), dtype=np.uint8)].sum())
+
+
+def category_counts(sequence: str) -> np.ndarray:
+    """
+    Number of symbols of each report category from the symbol_histogram of the ASCII sequence:
+        category_counts('ANRR-?x')[TWO_NUCLEOTIDES] == 2
+    """
+    return np.bincount(CATEGORY_TABLE, weights=symbol_histogram(sequence), minlength=OTHER + 1).astype(np.int64)
@@ -0,0 +1,99 @@
+import json
+import os
+from hashlib import sha256
+from itertools import repeat
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Union
+
+from common.parallel import parallel_map
+
+# Chunk size for hashing input files (1 MiB)
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def manifest_path(output_path: Union[str, Path], script_name: str) -> Path:
+    # Manifest of the script is kept in its output directory: {output}/.{script_name}_manifest.json
+    return Path(output_path) / f'.{script_name}_manifest.json'
+
+
+def load_manifest(output_path: Union[str, Path], script_name: str) -> Dict[str, Any]:
+    # Missing or unreadable manifest means that every input file is processed again
+    try:
+        with open(manifest_path(output_path, script_name), 'r') as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest: Dict[str, Any], output_path: Union[str, Path], script_name: str) -> None:
+    # Write to a temporary file first, so an interrupted run never leaves a broken manifest
+    path = manifest_path(output_path, script_name)
+    with open(f'{path}.tmp', 'w') as handle:
+        json.dump(manifest, handle, indent=1, sort_keys=True)
+    os.replace(f'{path}.tmp', path)
+
+
+def content_hash(file: Union[str, Path]) -> str:
+    file_hash = sha256()
+    with open(file, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(HASH_CHUNK_SIZE), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def cached_result(manifest: Dict[str, Any], input_file: Union[str, Path], parameters: Dict[str, Any],
+                  output_files: Iterable[Union[str, Path]]) -> Optional[Any]:
+    """
+    Result stored for the input file if it can be reused, otherwise None:
+        - CLI parameters are the same and all output files of the input still exist
+        - size and mtime are the same, or only mtime has changed and the content hash is the same (touched file)
+    """
+    entry = manifest.get(str(Path(input_file).resolve()))
+    if entry is None or entry['parameters'] != parameters or not all(map(os.path.isfile, output_files)):
+        return None
+
+    stat = os.stat(input_file)
+    if (stat.st_size, stat.st_mtime_ns) != (entry['size'], entry['mtime_ns']):
+        if stat.st_size != entry['size'] or content_hash(input_file) != entry['sha256']:
+            return None
+        entry['mtime_ns'] = stat.st_mtime_ns
+
+    return entry['result']
+
+
+def store_result(manifest: Dict[str, Any], input_file: Union[str, Path], parameters: Dict[str, Any],
+                 result: Any) -> None:
+    # Result must be JSON serializable (tuples are restored as lists)
+    stat = os.stat(input_file)
+    manifest[str(Path(input_file).resolve())] = {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': content_hash(input_file),
+        'parameters': parameters,
+        'result': result
+    }
+
+
+def incremental_map(function: Callable, workers: int, input_files: Iterable[Path], arguments: tuple,
+                    manifest: Optional[Dict[str, Any]], parameters: Dict[str, Any],
+                    output_files: Callable[[Path], Iterable[Union[str, Path]]]) -> Iterator[Any]:
+    """
+    parallel_map(function, workers, input_files, *arguments) which yields results in the order of input files,
+    reusing results of unchanged input files from the manifest (manifest=None processes all files).
+    output_files(input_file) lists the files the function writes for the input file
+    """
+    input_files = list(input_files)
+    if manifest is None:
+        yield from parallel_map(function, workers, input_files, *map(repeat, arguments))
+        return
+
+    results = {input_file: cached_result(manifest, input_file, parameters, output_files(input_file))
+               for input_file in input_files}
+    changed_files = [input_file for input_file, result in results.items() if result is None]
+
+    changed_results = parallel_map(function, workers, changed_files, *map(repeat, arguments))
+    for input_file in input_files:
+        if results[input_file] is None:
+            results[input_file] = next(changed_results)
+            store_result(manifest, input_file, parameters, results[input_file])
+        yield results[input_file]
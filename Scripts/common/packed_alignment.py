@@ -0,0 +1,95 @@
+"""
+Packed alignment (.pal) - Geneious alignment converted once for repeated consensus runs:
+    b'PAL1' | uint32 (little endian) size of the header table | header table (JSON) | rows
+Header table:
+    {"primary": Primary name, "reference_length": reflen or "N/A", "length": alignment length,
+     "headers": [Primary name, enhancer names with _N suffix, ...], "primary_unknown": [[start, end], ...]}
+Rows (Primary first) store 4-bit codes, two positions per byte (even position in the high nibble):
+    code = bit mask of A (1), T (2), G (4), C (8), N = 15, '-' = 0 (MASK_TABLE of common/iupac.py)
+'?' has the same scores as '-', so it is stored as '-' in enhancers; '?' runs of the Primary are kept in
+"primary_unknown" (both ends inclusive), because the Primary gaps define the consensus range.
+Rows are memory-mapped and unpacked by blocks of columns, so a whole ASCII alignment matrix is never built
+"""
+import json
+from pathlib import Path
+from typing import Dict, Tuple, Union
+
+import numpy as np
+
+from common.iupac import MASK_TABLE, MASK_ASCII, UNKNOWN_MASK
+
+PACKED_SUFFIX = '.pal'
+MAGIC = b'PAL1'
+
+
+def write_packed_alignment(file: Union[str, Path], primary_name: str, sequences: Dict[str, str],
+                           reference_length: str) -> None:
+    # Sequences are {header: aligned sequence} with the Primary under primary_name
+    headers = [primary_name] + [header for header in sequences.keys() if header != primary_name]
+    lengths = {len(sequences[header]) for header in headers}
+    if len(lengths) != 1:
+        raise ValueError(f'Aligned sequences of {primary_name} have different lengths: {sorted(lengths)}')
+    length = lengths.pop()
+
+    primary_unknown = []
+    for position, symbol in enumerate(sequences[primary_name]):
+        if symbol == '?':
+            if primary_unknown and primary_unknown[-1][1] == position - 1:
+                primary_unknown[-1][1] = position
+            else:
+                primary_unknown.append([position, position])
+
+    header_table = json.dumps({'primary': primary_name, 'reference_length': reference_length, 'length': length,
+                               'headers': headers, 'primary_unknown': primary_unknown}).encode()
+
+    with open(file, 'wb') as outfile:
+        outfile.write(MAGIC)
+        outfile.write(len(header_table).to_bytes(4, 'little'))
+        outfile.write(header_table)
+
+        for header in headers:
+            codes = MASK_TABLE[np.frombuffer(sequences[header].encode(), dtype=np.uint8)]
+            if (codes == UNKNOWN_MASK).any():
+                raise KeyError(f'Non-IUPAC symbols in {header}')
+            if length % 2:
+                codes = np.append(codes, np.uint8(0))
+            outfile.write(((codes[0::2] << 4) | codes[1::2]).tobytes())
+
+
+def open_packed_alignment(file: Union[str, Path]) -> Tuple[dict, np.ndarray]:
+    """
+    Header table and the memory-mapped rows of the packed alignment, nothing is unpacked:
+        (header table, uint8 memmap (rows = headers, Primary first) of (length + 1) // 2 bytes per row)
+    """
+    with open(file, 'rb') as handle:
+        if handle.read(4) != MAGIC:
+            raise ValueError(f'{file} is not a packed alignment')
+        header_table_size = int.from_bytes(handle.read(4), 'little')
+        header_table = json.loads(handle.read(header_table_size))
+
+    rows_number, length = len(header_table['headers']), header_table['length']
+    if not length:
+        return header_table, np.empty((rows_number, 0), dtype=np.uint8)
+    return header_table, np.memmap(file, dtype=np.uint8, mode='r', offset=8 + header_table_size,
+                                   shape=(rows_number, (length + 1) // 2))
+
+
+def unpack_columns(header_table: dict, packed: np.ndarray, start: int, end: int) -> np.ndarray:
+    """
+    ASCII matrix of the alignment columns start..end - 1 of the packed rows (or of the first rows only, e.g.
+    packed[:1] for the Primary), only the bytes of these columns are read from the memmap
+    """
+    end = min(end, header_table['length'])
+    if start >= end:
+        return np.empty((packed.shape[0], 0), dtype=np.uint8)
+
+    nibbles = packed[:, start // 2:(end + 1) // 2]
+    matrix = np.empty((packed.shape[0], 2 * nibbles.shape[1]), dtype=np.uint8)
+    matrix[:, 0::2] = MASK_ASCII[nibbles >> 4]
+    matrix[:, 1::2] = MASK_ASCII[nibbles & 15]
+    matrix = matrix[:, start % 2:start % 2 + end - start]
+
+    for unknown_start, unknown_end in header_table['primary_unknown']:
+        if unknown_start < end and unknown_end >= start:
+            matrix[0, max(unknown_start, start) - start:min(unknown_end + 1, end) - start] = ord('?')
+    return matrix
@@ -0,0 +1,79 @@
+"""
+Pangenome categories of genes by the number of isolates they are present in (Roary definitions by default):
+    Core            CORE * isolates <= present
+    Soft-core       SOFT_CORE * isolates <= present < CORE * isolates
+    Shell           SHELL * isolates <= present < SOFT_CORE * isolates
+    Cloud           present < SHELL * isolates
+Presence is the numpy.packbits bit matrix genes x isolates of common.roary, counts are taken from the packed bytes
+"""
+from argparse import ArgumentParser, ArgumentTypeError
+from typing import Tuple
+
+import numpy as np
+
+CATEGORIES = ('Core', 'Soft-core', 'Shell', 'Cloud')
+CORE, SOFT_CORE, SHELL, CLOUD = range(len(CATEGORIES))
+# Minimal fractions of isolates of Core, Soft-core and Shell genes, Cloud genes are the rest
+DEFAULT_THRESHOLDS = (0.99, 0.95, 0.15)
+
+# Number of set bits of every byte value
+BYTE_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1, dtype=np.uint8)
+
+
+def _fraction(value: str) -> float:
+    fraction = float(value)
+    if not 0 < fraction <= 1:
+        raise ArgumentTypeError(f'Threshold should be a fraction of isolates in (0, 1], got {value}')
+    return fraction
+
+
+def threshold_arguments(parser: ArgumentParser):
+    # Category thresholds options, shared by the scripts reporting pangenome categories
+    core, soft_core, shell = DEFAULT_THRESHOLDS
+    parser.add_argument('--core', type=_fraction, default=core,
+                        help=f'Minimal fraction of isolates of core genes (default: {core})')
+    parser.add_argument('--soft_core', type=_fraction, default=soft_core,
+                        help=f'Minimal fraction of isolates of soft-core genes (default: {soft_core})')
+    parser.add_argument('--shell', type=_fraction, default=shell,
+                        help=f'Minimal fraction of isolates of shell genes (default: {shell})')
+
+
+def category_thresholds(args) -> Tuple[float, float, float]:
+    # Validated (core, soft_core, shell) thresholds of the parsed threshold_arguments
+    thresholds = (args.core, args.soft_core, args.shell)
+    if not thresholds[0] >= thresholds[1] >= thresholds[2]:
+        raise ArgumentTypeError(f'Thresholds should be ordered as core >= soft_core >= shell, got {thresholds}')
+    return thresholds
+
+
+def isolate_counts(presence: np.ndarray) -> np.ndarray:
+    # Number of isolates of every gene, packbits pads rows with zero bits
+    return BYTE_POPCOUNT[presence].sum(axis=1, dtype=np.int64)
+
+
+def classify_genes(counts: np.ndarray, isolates_number: int,
+                   thresholds: Tuple[float, float, float] = DEFAULT_THRESHOLDS) -> np.ndarray:
+    """
+    Category (CORE, SOFT_CORE, SHELL or CLOUD) of every gene by its number of isolates:
+        classify_genes(np.array([40, 38, 6, 5]), 40) -> [CORE, SOFT_CORE, SHELL, CLOUD]
+    """
+    # Ascending minimal counts of Shell, Soft-core and Core, a gene reaching k of them is in category 3 - k
+    minimal_counts = np.asarray(thresholds[::-1], dtype=float) * isolates_number
+    return (CLOUD - np.searchsorted(minimal_counts, counts, side='right')).astype(np.uint8)
+
+
+def category_totals(categories: np.ndarray) -> np.ndarray:
+    # Number of genes of every category
+    return np.bincount(categories, minlength=len(CATEGORIES))
+
+
+def sample_category_counts(presence: np.ndarray, isolates_number: int, categories: np.ndarray) -> np.ndarray:
+    """
+    Number of genes of every category present in every isolate, categories x isolates:
+        sample_category_counts(presence, len(isolates), categories)[CORE, isolate_column]
+    """
+    counts = np.zeros((len(CATEGORIES), isolates_number), dtype=np.int64)
+    for category in range(len(CATEGORIES)):
+        # Column sums of the category rows, bits of the packed bytes are unpacked for these rows only
+        counts[category] = np.unpackbits(presence[categories == category], axis=1, count=isolates_number).sum(axis=0)
+    return counts
@@ -0,0 +1,14 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, Iterator
+
+
+def parallel_map(function: Callable, workers: int, *iterables: Iterable) -> Iterator[Any]:
+    """
+    map() over a process pool of WORKERS processes (serial map() for a single worker).
+    Results are yielded in the order of the inputs, so reports don't depend on the number of workers
+    """
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(function, *iterables)
+    else:
+        yield from map(function, *iterables)
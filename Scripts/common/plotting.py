@@ -0,0 +1,48 @@
+"""
+Headless plotting shared by the plotting scripts. matplotlib (and seaborn, scipy plotting) are imported only when a
+figure is drawn, always with the non-interactive Agg backend, so table-only runs don't import them at all.
+Independent figures are rendered in separate worker processes:
+    render_plots([(create_heatmap, (df, output_dir, prefix)), (create_dendrogram, (...))], workers)
+"""
+from argparse import ArgumentParser, Namespace
+from typing import Callable, List, Sequence, Tuple
+
+from common.parallel import parallel_map
+
+
+def pyplot():
+    # matplotlib.pyplot with the Agg backend (no display needed on batch nodes)
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def plot_arguments(parser: ArgumentParser, plots: Sequence[str]):
+    # --plots/--no-plots options, PLOTS are the names of the figures of the script
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--plots', type=str, default=','.join(plots),
+                       help=f'Comma separated figures to render (default: all, {",".join(plots)})')
+    group.add_argument('--no-plots', action='store_true', help='Write tables only, without figures')
+
+
+def selected_plots(parser: ArgumentParser, args: Namespace, plots: Sequence[str]) -> List[str]:
+    # Validated figure names of the parsed plot_arguments, in the order of PLOTS
+    if args.no_plots:
+        return []
+    requested = {plot.strip() for plot in args.plots.split(',') if plot.strip()}
+    unknown_plots = requested - set(plots)
+    if unknown_plots:
+        parser.error(f'Unknown plots: {", ".join(sorted(unknown_plots))} (choose from {", ".join(plots)})')
+    return [plot for plot in plots if plot in requested]
+
+
+def _render(plot: Tuple[Callable, tuple]) -> None:
+    function, arguments = plot
+    function(*arguments)
+
+
+def render_plots(plots: Sequence[Tuple[Callable, tuple]], workers: int = 1) -> None:
+    # Call every (function, arguments) figure renderer, one figure per worker process for several workers
+    for _ in parallel_map(_render, min(workers, len(plots)), plots):
+        pass
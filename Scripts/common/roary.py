@@ -0,0 +1,107 @@
+"""
+Columnar cache of Roary gene_presence_absence.csv, built once next to the CSV and rebuilt when the CSV changes:
+    {csv}.presence.npz      signature       int64 [size, mtime_ns] of the CSV the cache was built from
+                            genes           Gene column
+                            annotations     Annotation column
+                            isolates        isolate names (columns after the metadata columns)
+                            presence        numpy.packbits bit matrix, genes x isolates (bits along isolates)
+                            counts          number of isolates of every gene
+Members of .npz are read lazily, so scripts load only the fields they ask for.
+The CSV is read in row chunks and isolate cells (locus tags) are turned into presence bits at once, so the peak memory
+of a build scales with genes x isolates bits and not with the size of the text
+"""
+import os
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterator, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+ROARY_FILE = 'gene_presence_absence.csv'
+# Gene, Non-unique Gene name, Annotation, No. isolates, ... Avg group size nuc precede isolate columns
+METADATA_COLUMNS = 14
+CACHE_SUFFIX = '.presence.npz'
+CACHE_FIELDS = ('genes', 'annotations', 'isolates', 'presence', 'counts')
+# Isolate cells parsed at once while streaming the CSV (rows of a chunk = CHUNK_CELLS / isolates)
+CHUNK_CELLS = 1 << 20
+
+
+def _file_signature(file: Union[str, Path]) -> np.ndarray:
+    # Cache is valid only for the same size and modification time of the CSV file
+    stat = os.stat(file)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def presence_chunks(csv_file: Union[str, Path],
+                    chunk_cells: int = CHUNK_CELLS) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Stream the CSV as (genes, annotations, presence) row chunks, presence is the boolean matrix chunk rows x isolates
+    (empty isolate cells are absent genes). Strings of isolate cells are dropped as soon as their chunk is converted
+    """
+    isolates_number = len(isolate_names(csv_file))
+    chunk_rows = max(1, chunk_cells // max(1, isolates_number))
+    with pd.read_csv(csv_file, dtype=str, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            yield (chunk['Gene'].to_numpy(dtype=str), chunk['Annotation'].fillna('').to_numpy(dtype=str),
+                   chunk.iloc[:, METADATA_COLUMNS:].notna().to_numpy())
+
+
+def isolate_names(csv_file: Union[str, Path]) -> np.ndarray:
+    # Isolate columns of the CSV header
+    return pd.read_csv(csv_file, nrows=0).columns[METADATA_COLUMNS:].to_numpy(dtype=str)
+
+
+def build_presence_store(csv_file: Union[str, Path], chunk_cells: int = CHUNK_CELLS) -> Dict[str, np.ndarray]:
+    # Stream the CSV and return the cache fields, counts and packed presence are accumulated chunk by chunk
+    genes, annotations, presence, counts = [], [], [], []
+    for chunk_genes, chunk_annotations, chunk_presence in presence_chunks(csv_file, chunk_cells):
+        genes.append(chunk_genes)
+        annotations.append(chunk_annotations)
+        presence.append(np.packbits(chunk_presence, axis=1))
+        counts.append(chunk_presence.sum(axis=1))
+
+    isolates = isolate_names(csv_file)
+    return {
+        'genes': np.concatenate(genes) if genes else np.empty(0, dtype=str),
+        'annotations': np.concatenate(annotations) if annotations else np.empty(0, dtype=str),
+        'isolates': isolates,
+        'presence': np.concatenate(presence) if presence else np.empty((0, (len(isolates) + 7) // 8), np.uint8),
+        'counts': np.concatenate(counts) if counts else np.empty(0, dtype=np.int64)
+    }
+
+
+def load_presence_absence(csv_file: Union[str, Path], *fields: str) -> tuple:
+    """
+    Requested fields of the cached gene_presence_absence.csv in the same order (see the module docstring):
+        isolates, presence = load_presence_absence(csv_file, 'isolates', 'presence')
+    Missing or outdated cache is rebuilt, read-only directories are parsed without caching
+    """
+    unknown_fields = set(fields) - set(CACHE_FIELDS)
+    if unknown_fields:
+        raise KeyError(f'Unknown gene_presence_absence fields: {", ".join(sorted(unknown_fields))}')
+
+    cache_file, signature = f'{csv_file}{CACHE_SUFFIX}', _file_signature(csv_file)
+    if os.path.isfile(cache_file):
+        try:
+            with np.load(cache_file) as cache:
+                if np.array_equal(cache['signature'], signature):
+                    return tuple(cache[field] for field in fields)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            pass
+
+    store = build_presence_store(csv_file)
+    try:
+        # Write to a temporary file first, so an interrupted run never leaves a broken cache
+        with open(f'{cache_file}.tmp', 'wb') as handle:
+            np.savez(handle, signature=signature, **store)
+        os.replace(f'{cache_file}.tmp', cache_file)
+    except OSError:
+        pass
+
+    return tuple(store[field] for field in fields)
+
+
+def presence_matrix(presence: np.ndarray, isolates_number: int) -> np.ndarray:
+    # Unpacked boolean matrix genes x isolates of the packed presence bits
+    return np.unpackbits(presence, axis=1, count=isolates_number).astype(bool)
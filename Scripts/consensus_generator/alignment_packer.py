@@ -0,0 +1,58 @@
+from argparse import ArgumentParser, RawTextHelpFormatter, ArgumentError, ArgumentTypeError
+from pathlib import Path
+import sys
+
+from consensus_generator import file_to_dict
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Scripts directory with the shared common package
+from common.packed_alignment import PACKED_SUFFIX, write_packed_alignment
+
+desc = "Script converts CONTIGS output from geneious (FASTA alignments) once into packed alignments for " \
+       "consensus_generator.py -p. Packed alignment keeps 4-bit IUPAC codes (two per byte) and a header table " \
+       "with the Primary, _reflen_ and enhancer names, so consensus runs with different GAP values skip parsing.\n\n" \
+       "└INPUT_DIRECTORY (exists)               └OUTPUT_DIRECTORY (exists or will be created)\n" \
+       "   ├ {name_1}.fasta (exists)      =>      ├ {name_1}.pal (will be created/overwritten)\n" \
+       "   └ {name_2}.fasta (exists)      =>      └ {name_2}.pal (will be created/overwritten)"
+
+usage = "python3 <script_name>.py [-h] -i INPUT -o OUTPUT\n\n" \
+        "Options:\n" \
+        "-i, --input             Input directory path\n" \
+        "-o, --output            Output directory path" \
+
+parser = ArgumentParser(description=desc, formatter_class=RawTextHelpFormatter, usage=usage)
+parser.add_argument('-i', '--input', type=str, help='Input directory path', required=True)
+parser.add_argument('-o', '--output', type=str, help='Output directory path', required=True)
+
+
+def initialization():
+    try:
+        args = parser.parse_args()
+
+        # Required
+        input_path: Path = Path(args.input).resolve()
+        output_path: Path = Path(args.output).resolve()
+
+        return input_path, output_path
+
+    except (ArgumentError, ArgumentTypeError) as e:
+        print(f'Check help! Error: {e}')
+        exit(1)
+
+
+def main():
+    input_path, output_path = initialization()
+
+    # Create {output_path} if it doesn't exist
+    if not output_path.exists():
+        output_path.mkdir()
+
+    for input_file in sorted(input_path.glob('*.fasta')):
+        primary_name, sequences, reference_length = file_to_dict(input_file)
+        write_packed_alignment(output_path / f'{input_file.stem}{PACKED_SUFFIX}', primary_name, sequences,
+                               reference_length)
+
+    print("Successful run!")  # For logging purposes
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,19 @@
 from collections import defaultdict
+from functools import partial
 from argparse import ArgumentParser, RawTextHelpFormatter, ArgumentError, ArgumentTypeError
 from pathlib import Path
-from copy import deepcopy
-from time import sleep
+from re import compile as re_compile
+import sys
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Scripts directory with the shared common package
+from common.fasta_reader import fasta_records
+from common.fasta_index import build_sequence_layout, read_sequence_region
+from common.manifest import load_manifest, save_manifest, incremental_map
+from common.packed_alignment import PACKED_SUFFIX, open_packed_alignment, unpack_columns
+from common.iupac import MASK_TABLE, MASK_ASCII, QUALITY_TABLE, UNKNOWN_MASK, category_counts, \
+    TWO_NUCLEOTIDES, THREE_NUCLEOTIDES, ANY_NUCLEOTIDE, GAP, UNKNOWN, OTHER
 
 desc = "Script is used for working with CONTIGS output from geneious to fill in gaps and decrease level of ambiguous" \
        "data based on the enhancer value and consensus optimization.\n" \
@@ -15,17 +26,38 @@ desc = "Script is used for working with CONTIGS output from geneious to fill in
        "If there is no nucleotides with a good score, N will be placed only in case if number of N values for the" \
        "same base position >=2. If the base quality is decreased (total score), Primary value will be used"
 
-usage = "python3 <script_name>.py [-h] -i INPUT -o OUTPUT [-g GAP]\n\n" \
+usage = "python3 <script_name>.py [-h] -i INPUT -o OUTPUT [-g GAP] [-e ENGINE] [-w WORKERS] [-I] [-p] [-t]\n" \
+        "                        [-W WINDOW]\n\n" \
         "Options:\n" \
         "-i, --input             Input directory path\n" \
         "-o, --output            Output directory path\n" \
-        "-g, --gap               Gap size to be ignored (default: 150)" \
+        "-g, --gap               Gap size to be ignored (default: 150)\n" \
+        "-e, --engine            Consensus engine: column or matrix (default: column)\n" \
+        "-w, --workers           Number of files processed in parallel (default: 1)\n" \
+        "-I, --incremental       Skip input files unchanged since the previous run with the same GAP\n" \
+        "-p, --packed            Input directory contains packed alignments (.pal) from alignment_packer.py,\n" \
+        "                        always processed in blocks of WINDOW columns (default: 65536)\n" \
+        "-t, --trace             Write columns without quality to {name}_ambiguous_columns.tsv\n" \
+        "-W, --window            Process alignments in blocks of WINDOW columns (default: 0, whole alignment)" \
 
 parser = ArgumentParser(description=desc, formatter_class=RawTextHelpFormatter, usage=usage)
 parser.add_argument('-i', '--input', type=str, help='Input directory path', required=True)
 parser.add_argument('-o', '--output', type=str, help='Output directory path', required=True)
 parser.add_argument('-g', '--gap', type=int, help='Gap size in Primary sequence to be ignored by the consensus',
                     default=150)
+parser.add_argument('-e', '--engine', type=str, choices=['column', 'matrix'],
+                    help='Consensus engine: per-column (column) or NumPy alignment matrix (matrix)', default='column')
+parser.add_argument('-w', '--workers', type=int, help='Number of worker processes, one input file per worker',
+                    default=1)
+parser.add_argument('-I', '--incremental', action='store_true',
+                    help='Reuse results of unchanged input files from the manifest in the output directory')
+parser.add_argument('-p', '--packed', action='store_true',
+                    help='Read packed alignments (*.pal) instead of FASTA, always in blocks of WINDOW columns')
+parser.add_argument('-t', '--trace', action='store_true',
+                    help='Write diagnostics of columns without quality (N or dropped) to a TSV file per input file')
+parser.add_argument('-W', '--window', type=int,
+                    help='Columns per block for chromosome-scale alignments, always with the matrix engine',
+                    default=0)
 
 
 def initialization():
@@ -38,8 +70,18 @@ def initialization():
 
         # Optional
         gap_size: int = args.gap
-
-        return input_path, output_path, gap_size
+        engine: str = args.engine
+        workers: int = args.workers
+        if workers < 1:
+            raise ArgumentTypeError(f'Number of workers should be at least 1, got {workers}')
+        incremental: bool = args.incremental
+        packed: bool = args.packed
+        trace: bool = args.trace
+        window: int = args.window
+        if window < 0:
+            raise ArgumentTypeError(f'Window size should be 0 (disabled) or positive, got {window}')
+
+        return input_path, output_path, gap_size, engine, workers, incremental, packed, trace, window
 
     except (ArgumentError, ArgumentTypeError) as e:
         print(f'Check help! Error: {e}')
@@ -80,69 +122,76 @@ def start_and_end_positions(sequences, primary_name):
     return start, end
 
 
-def file_to_dict(file):
-    with open(file, 'r') as handle:
-        lines = handle.readlines()
-
-    # Create defaultdict to store sequences keyed by header, get header name for the reference separately
-    sequences = defaultdict(list)
-    primary_name, header, reference_length = 'Error', '', 'N/A'
-    primary_assigned = False
-    enhancer_id = 1
-    for line in lines:
-        if not primary_assigned:
-            if line.startswith('>'):
-                header_arg_list = line.strip().split("_")
-                if "reflen" in header_arg_list:
-                    header = '_'.join(header_arg_list[0:header_arg_list.index("reflen")])
-                    reference_length = header_arg_list[header_arg_list.index("reflen") + 1]  # If ref length is present
-                else:
-                    header = line.strip()
-                primary_name, primary_assigned = deepcopy(header), True if header else None
-            else:
-                sequences[header].append(line.strip())
-
-        else:
-            if line.startswith('>'):
-                header = line.strip() + '_' + str(enhancer_id)
-                enhancer_id += 1
-            else:
-                sequences[header].append(line.strip())
+def primary_header(header):
+    # Primary name and reference length from the header of the first record (XXXX_reflen_500_YYYY => XXXX, 500)
+    header_arg_list, reference_length = header.split("_"), 'N/A'
+    if "reflen" in header_arg_list:
+        header = '_'.join(header_arg_list[0:header_arg_list.index("reflen")])
+        reference_length = header_arg_list[header_arg_list.index("reflen") + 1]  # If ref length is present
+    return header, reference_length
 
-    # Create defaultdict to store trimmed sequences in str type
 
+def file_to_dict(file):
+    # Create defaultdict to store sequences in str type keyed by header, get header name for the reference separately
     str_sequences = defaultdict(str)
-    for header in sequences.keys():
-        str_sequences[header] = ''.join(sequences[header])
+    primary_name, reference_length = 'Error', 'N/A'
+    for enhancer_id, (header, sequence) in enumerate(fasta_records(file)):
+        if not enhancer_id:
+            header, reference_length = primary_header(header)
+            primary_name = header
+        else:
+            header = header + '_' + str(enhancer_id)
+
+        str_sequences[header] = sequence
 
     return primary_name, str_sequences, reference_length
 
 
-def gap_definer(sequences, primary_name, gap_size_defined, seq_start_pos, seq_end_pos):
-    gap_positions = []
-    for index in range(seq_start_pos, seq_end_pos + 1):
-        if sequences[primary_name][index] in '-' and index not in gap_positions:
-            gap_start_position, gap_last_position = index, index
-            end_trigger = False
-            for gap_position in range(index, seq_end_pos + 1):
-                if gap_position + 1 <= seq_end_pos:
-                    if sequences[primary_name][gap_position] in '-':
-                        continue
-                    else:
-                        gap_last_position = gap_position - 1
-                        break
-                else:
-                    end_trigger = True
-                    break
+GAP_RUN = re_compile('-+')
 
-            if end_trigger:
-                break
-            else:
-                if gap_last_position - gap_start_position <= gap_size_defined:
-                    for gap_index in range(gap_start_position, gap_last_position + 1):
-                        gap_positions.append(gap_index)
 
-    return gap_positions
+def gap_definer(sequences, primary_name, gap_size_defined, seq_start_pos, seq_end_pos):
+    """
+    Single pass over the runs of '-' in the Primary sequence between seq_start_pos and seq_end_pos.
+    Returns sorted (start, end) intervals (both inclusive) of positions ignored by the consensus:
+        - a gap run reaching the position before seq_end_pos stops the search (end trigger)
+        - for each other run, positions are taken from its end while their span is <= gap_size_defined,
+          i.e. short runs are ignored completely and long runs lose only their last gap_size_defined + 1 positions
+    """
+    gap_intervals = []
+    for gap_run in GAP_RUN.finditer(sequences[primary_name], seq_start_pos, seq_end_pos + 1):
+        gap_start_position, gap_last_position = gap_run.start(), gap_run.end() - 1
+
+        if gap_last_position + 1 >= seq_end_pos:
+            break
+
+        gap_start_position = max(gap_start_position, gap_last_position - gap_size_defined)
+        if gap_start_position <= gap_last_position:
+            gap_intervals.append((gap_start_position, gap_last_position))
+
+    return gap_intervals
+
+
+def included_positions(seq_start_pos, seq_end_pos, gap_intervals):
+    # Yield (start, end) ranges (both inclusive) between seq_start_pos and seq_end_pos not covered by gap_intervals
+    position = seq_start_pos
+    for gap_start_position, gap_last_position in gap_intervals:
+        if gap_start_position > position:
+            yield position, gap_start_position - 1
+        position = gap_last_position + 1
+    if position <= seq_end_pos:
+        yield position, seq_end_pos
+
+
+# Consensus scoring tables from the shared IUPAC codec (indexed by the ASCII code of a symbol / mask of bases):
+#   N adds no score to A, T, G, C, it is counted separately (primary/enhancer N)
+#   C + G gives 'E': the former iupac_bases lookup had only 'GC' for the sorted 'CG' key, kept for the same consensus
+SCORE_MASK_TABLE = MASK_TABLE.copy()
+SCORE_MASK_TABLE[ord('N')] = 0
+VALUE_TABLE = MASK_ASCII.copy()
+VALUE_TABLE[MASK_TABLE[ord('S')]] = ord('E')
+# Lists of the same tables for the column engine (faster than NumPy scalars)
+SCORE_MASKS, VALUES, QUALITIES = SCORE_MASK_TABLE.tolist(), VALUE_TABLE.tolist(), QUALITY_TABLE.tolist()
 
 
 def separate_score_calculator(base_from_sequences, primary_name):
@@ -152,89 +201,51 @@ def separate_score_calculator(base_from_sequences, primary_name):
     enhancer_score = [0, 0, 0, 0]
     primary_4nt, enhancer_4nt = 0, 0
 
-    iupac_reverse_scores = {
-        #     A  T  G  C
-        'A': [1, 0, 0, 0],
-        'T': [0, 1, 0, 0],
-        'G': [0, 0, 1, 0],
-        'C': [0, 0, 0, 1],
-        'R': [1, 0, 1, 0],
-        'Y': [0, 1, 0, 1],
-        'S': [0, 0, 1, 1],
-        'W': [1, 1, 0, 0],
-        'K': [0, 1, 1, 0],
-        'M': [1, 0, 0, 1],
-        'B': [0, 1, 1, 1],
-        'D': [1, 1, 1, 0],
-        'H': [1, 1, 0, 1],
-        'V': [1, 0, 1, 1],
-        'N': [0, 0, 0, 0],
-        '-': [0, 0, 0, 0],
-        '?': [0, 0, 0, 0]
-    }
     primary_value = ''
-    for header in base_from_sequences.keys():
+    for header, base in base_from_sequences.items():
+        mask = SCORE_MASKS[ord(base)]
+        if mask == UNKNOWN_MASK:
+            raise KeyError(base)
+
         if header == primary_name:
-            primary_value = base_from_sequences[primary_name]
-            if primary_value == 'N':
+            primary_value, base_score = base, primary_score
+            if base == 'N':
                 primary_4nt += 1
-            else:
-                for i, score in enumerate(iupac_reverse_scores[primary_value]):
-                    primary_score[i] += score
         else:
-            for i, score in enumerate(iupac_reverse_scores[base_from_sequences[header]]):
-                if base_from_sequences[header] == 'N':
-                    enhancer_4nt += 1
-                else:
-                    enhancer_score[i] += score
+            base_score = enhancer_score
+            # An enhancer N is counted once per base (A, T, G, C)
+            if base == 'N':
+                enhancer_4nt += 4
 
-        for i, score in enumerate(iupac_reverse_scores[base_from_sequences[header]]):
-            total_score[i] += score
+        for i in range(4):
+            if (mask >> i) & 1:
+                base_score[i] += 1
+                total_score[i] += 1
 
     return total_score, primary_score, enhancer_score, primary_4nt, enhancer_4nt, primary_value
 
 
 def score_to_value(total_score):
-    iupac_bases = {
-        'A': 'A', 'T': 'T', 'C': 'C', 'G': 'G', 'AG': 'R', 'CT': 'Y', 'GC': 'S', 'AT': 'W', 'GT': 'K', 'AC': 'M',
-        'CGT': 'B', 'AGT': 'D', 'ACT': 'H', 'ACG': 'V', 'ACGT': 'N'
-    }
-
-    # Base score calculation
+    # Symbol of the best scored bases (mask of the bases with the maximal score)
     max_val = max(total_score)
-
-    mask = ['A', 'T', 'G', 'C']
-
-    max_bases = [mask[index] for index, value in enumerate(total_score) if value == max_val]
-    total_val = iupac_bases.get(''.join(sorted(max_bases)), 'E')
-
-    return total_val
+    return chr(VALUES[sum(1 << bit for bit, value in enumerate(total_score) if value == max_val)])
 
 
-def nt_score_calculator(base_from_sequences, primary_name):
-    iupac = {
-        'AGTC': 4, 'RYMKSW': 3, 'HBVD': 2, 'N-': 0
-    }
-
+def nt_score_calculator(base_from_sequences, primary_name, trace=None):
+    # trace(consensus value, total value, primary value, qualities, N counts) is called for columns without quality
     total_score, primary_score, enhancer_score, primary_4nt, enhancer_4nt, primary_val = \
         separate_score_calculator(base_from_sequences, primary_name)
 
     total_val = score_to_value(total_score)
 
     # Quality
-    total_quality, primary_quality = 0, 0
-    for bases, score in iupac.items():
-        if total_val in bases:
-            total_quality = score
-        if primary_val in bases:
-            primary_quality = score
-
-    if total_quality == primary_quality == 0 and primary_4nt + enhancer_4nt >= 2:
-        print(f"\n\n{total_val} | {primary_val}\n{total_quality} | {primary_quality}\n{primary_4nt} | {enhancer_4nt}")
-        sleep(5)
-        return 'N'
-    elif total_quality == primary_quality == 0 and primary_4nt + enhancer_4nt < 2:
-        return ''
+    total_quality, primary_quality = QUALITIES[ord(total_val)], QUALITIES[ord(primary_val)]
+
+    if total_quality == primary_quality == 0:
+        consensus_value = 'N' if primary_4nt + enhancer_4nt >= 2 else ''
+        if trace is not None:
+            trace(consensus_value, total_val, primary_val, total_quality, primary_quality, primary_4nt, enhancer_4nt)
+        return consensus_value
     elif total_quality > primary_quality:
         return total_val
     elif primary_quality >= total_quality:
@@ -243,50 +254,211 @@ def nt_score_calculator(base_from_sequences, primary_name):
         return 'E'
 
 
-def consensus_generator(input_file, gap_size_defined):
+def sequences_to_matrix(sequences, primary_name):
+    # Rows = sequences (primary first), columns = alignment positions
+    headers = [primary_name] + [header for header in sequences.keys() if header != primary_name]
+    lengths = {len(sequences[header]) for header in headers}
+    if len(lengths) != 1:
+        raise ValueError(f'Aligned sequences of {primary_name} have different lengths: {sorted(lengths)}')
+
+    matrix = np.empty((len(headers), lengths.pop()), dtype=np.uint8)
+    for row, header in enumerate(headers):
+        matrix[row] = np.frombuffer(sequences[header].encode('ascii'), dtype=np.uint8)
+
+    return matrix
+
+
+def matrix_nt_score_calculator(matrix, trace=None):
+    """
+    Vectorized nt_score_calculator for all columns of the alignment matrix (row 0 = primary).
+    Returns uint8 array of consensus symbols, 0 for columns that are dropped from the consensus.
+    trace(column, consensus value, total value, primary value, qualities, N counts) is called for columns without
+    quality, in the same way as nt_score_calculator does
+    """
+    masks = SCORE_MASK_TABLE[matrix]
+    if (masks == UNKNOWN_MASK).any():
+        unknown = sorted({chr(code) for code in np.unique(matrix[masks == UNKNOWN_MASK])})
+        raise KeyError(f'Non-IUPAC symbols in the alignment: {"".join(unknown)}')
+
+    # Total score per base (A, T, G, C) and value of the best scored bases
+    total_score = np.stack([((masks >> bit) & 1).sum(axis=0) for bit in range(4)])
+    max_score = total_score.max(axis=0)
+    max_mask = sum((total_score[bit] == max_score).astype(np.uint8) << bit for bit in range(4))
+    total_val = VALUE_TABLE[max_mask]
+
+    primary_val = matrix[0]
+    total_quality, primary_quality = QUALITY_TABLE[total_val], QUALITY_TABLE[primary_val]
+
+    # Same N counting as separate_score_calculator: an enhancer N is counted once per base
+    primary_4nt = (primary_val == ord('N')).astype(np.int64)
+    enhancer_4nt = 4 * (matrix[1:] == ord('N')).sum(axis=0)
+
+    consensus = np.where(total_quality > primary_quality, total_val, primary_val)
+    no_quality = (total_quality == 0) & (primary_quality == 0)
+    consensus[no_quality] = np.where(primary_4nt[no_quality] + enhancer_4nt[no_quality] >= 2, ord('N'), 0)
+
+    if trace is not None:
+        for column in np.flatnonzero(no_quality):
+            trace(column, chr(consensus[column]) if consensus[column] else '', chr(total_val[column]),
+                  chr(primary_val[column]), total_quality[column], primary_quality[column], primary_4nt[column],
+                  enhancer_4nt[column])
+
+    return consensus
+
+
+TRACE_BUFFER_SIZE = 1 << 20
+# Columns per block of packed alignments without --window
+PACKED_WINDOW = 1 << 16
+TRACE_COLUMNS = ('position', 'consensus', 'total_value', 'primary_value', 'total_quality', 'primary_quality',
+                 'primary_N', 'enhancer_N')
+
+
+def write_trace_row(trace_outfile, nt_index, *diagnostics):
+    # Alignment position is 1-based in the trace, dropped columns have empty consensus
+    trace_outfile.write('\t'.join(map(str, (nt_index + 1, *diagnostics))) + '\n')
+
+
+def consensus_generator(input_file, gap_size_defined, engine='column', trace_outfile=None):
+    # Columns without quality are written to trace_outfile (TSV, TRACE_COLUMNS) if it is provided
     primary_name, sequences, reference_length = file_to_dict(input_file)
 
     # Get position of the first and the last non-gap nucleotide of the reference
     start_position, end_position = start_and_end_positions(sequences, primary_name)
 
-    gap_positions = gap_definer(sequences, primary_name, gap_size_defined, start_position, end_position)
+    gap_intervals = gap_definer(sequences, primary_name, gap_size_defined, start_position, end_position)
 
     consensus = {primary_name: []}
 
-    for nt_index in range(start_position, end_position + 1):
-        if nt_index in gap_positions:
-            continue
+    if engine == 'matrix':
+        matrix = sequences_to_matrix(sequences, primary_name)
+        columns = np.zeros(matrix.shape[1], dtype=bool)
+        for included_start, included_end in included_positions(start_position, end_position, gap_intervals):
+            columns[included_start:included_end + 1] = True
+
+        trace, positions = None, np.flatnonzero(columns)
+        if trace_outfile is not None:
+            def trace(column, *diagnostics):
+                write_trace_row(trace_outfile, positions[column], *diagnostics)
+
+        consensus_symbols = matrix_nt_score_calculator(matrix[:, columns], trace)
+        consensus[primary_name] = consensus_symbols[consensus_symbols != 0].tobytes().decode('ascii')
+
+    else:
+        for included_start, included_end in included_positions(start_position, end_position, gap_intervals):
+            for nt_index in range(included_start, included_end + 1):
+                base_from_sequences = defaultdict(str)
+                for header in sequences.keys():
+                    base_from_sequences[header] = sequences[header][nt_index]
 
-        base_from_sequences = defaultdict(str)
-        for header in sequences.keys():
-            base_from_sequences[header] = sequences[header][nt_index]
+                trace = partial(write_trace_row, trace_outfile, nt_index) if trace_outfile is not None else None
+                t = nt_score_calculator(base_from_sequences, primary_name, trace)
+                consensus[primary_name].append(t)
+
+        consensus[primary_name] = ''.join(consensus[primary_name])
+
+    consensus_statistics = empty_consensus_statistics(reference_length)
+    count_consensus_symbols(consensus[primary_name], consensus_statistics)
+
+    return consensus, consensus_statistics, primary_name
 
-        t = nt_score_calculator(base_from_sequences, primary_name)
-        consensus[primary_name].append(t)
 
-    consensus[primary_name] = ''.join(consensus[primary_name])
-    consensus_statistics = {
+def empty_consensus_statistics(reference_length):
+    return {
         "Reference length": reference_length,
-        "Consensus length": len(consensus[primary_name]),
+        "Consensus length": 0,
         "2 nt bp": 0,
         "3 nt bp": 0,
         "4 nt bp": 0,
         "Errors": 0,
     }
 
-    for bp in consensus[primary_name]:
-        if bp in "ATGC":
-            continue
-        elif bp in "RYMKSW":
-            consensus_statistics['2 nt bp'] += 1
-        elif bp in "HBVD":
-            consensus_statistics['3 nt bp'] += 1
-        elif bp == "N":
-            consensus_statistics['4 nt bp'] += 1
+
+def count_consensus_symbols(consensus_sequence, consensus_statistics):
+    # Add the consensus (or a block of it) to the statistics
+    counts = category_counts(consensus_sequence)
+    consensus_statistics['Consensus length'] += len(consensus_sequence)
+    consensus_statistics['2 nt bp'] += int(counts[TWO_NUCLEOTIDES])
+    consensus_statistics['3 nt bp'] += int(counts[THREE_NUCLEOTIDES])
+    consensus_statistics['4 nt bp'] += int(counts[ANY_NUCLEOTIDE])
+    consensus_statistics['Errors'] += int(counts[[GAP, UNKNOWN, OTHER]].sum())
+
+
+def fasta_blocks(handle, layout):
+    # Primary name, reference length, alignment length and block reader of the FASTA alignment (.fai-like layout)
+    if not layout:
+        raise ValueError(f'No sequences in {handle.name}')
+    primary_name, reference_length = primary_header(layout[0][0])
+    lengths = {length for _, _, length, _, _ in layout}
+    if len(lengths) != 1:
+        raise ValueError(f'Aligned sequences of {primary_name} have different lengths: {sorted(lengths)}')
+
+    def read_block(block_start, block_end, rows=len(layout)):
+        block = np.empty((rows, block_end - block_start), dtype=np.uint8)
+        for row, record in enumerate(layout[:rows]):
+            block[row] = np.frombuffer(read_sequence_region(handle, record, block_start, block_end), dtype=np.uint8)
+        return block
+
+    return primary_name, reference_length, lengths.pop(), read_block
+
+
+def packed_blocks(input_file):
+    # Primary name, reference length, alignment length and block reader of the memory-mapped packed alignment
+    header_table, packed = open_packed_alignment(input_file)
+
+    def read_block(block_start, block_end, rows=packed.shape[0]):
+        return unpack_columns(header_table, packed[:rows], block_start, block_end)
+
+    return header_table['primary'], header_table['reference_length'], header_table['length'], read_block
+
+
+def windowed_consensus_generator(input_file, output_path, gap_size_defined, window, trace_outfile=None):
+    """
+    Matrix engine over blocks of WINDOW alignment columns for chromosome-scale alignments.
+    FASTA rows are read by the .fai-like layout of the file, packed rows are unpacked from the memory map, and
+    the consensus of each block is written to {name}_filtered.fasta at once, so only the Primary (for the gaps)
+    and rows x WINDOW symbols are kept in memory.
+    Output, statistics and trace are the same as for the whole alignment
+    """
+    with open(input_file, 'rb') as handle, open(f"{output_path}/{input_file.stem}_filtered.fasta", 'w') as outfile:
+        if input_file.suffix == PACKED_SUFFIX:
+            primary_name, reference_length, length, read_block = packed_blocks(input_file)
         else:
-            consensus_statistics['Errors'] += 1
+            primary_name, reference_length, length, read_block = fasta_blocks(handle,
+                                                                              build_sequence_layout(input_file))
+        consensus_statistics = empty_consensus_statistics(reference_length)
+        sequences = {primary_name: read_block(0, length, rows=1)[0].tobytes().decode('ascii')}
 
-    return consensus, consensus_statistics, primary_name
+        # Get position of the first and the last non-gap nucleotide of the reference
+        start_position, end_position = start_and_end_positions(sequences, primary_name)
+
+        gap_intervals = gap_definer(sequences, primary_name, gap_size_defined, start_position, end_position)
+
+        columns = np.zeros(len(sequences[primary_name]), dtype=bool)
+        for included_start, included_end in included_positions(start_position, end_position, gap_intervals):
+            columns[included_start:included_end + 1] = True
+
+        # Positions of the current block's columns are looked up when the trace is called
+        trace, positions = None, None
+        if trace_outfile is not None:
+            def trace(column, *diagnostics):
+                write_trace_row(trace_outfile, positions[column], *diagnostics)
+
+        outfile.write(f'{primary_name}\n')
+        for window_start in range(start_position, end_position + 1, window):
+            window_end = min(window_start + window, end_position + 1)
+            window_columns = columns[window_start:window_end]
+            if not window_columns.any():
+                continue
+
+            positions = window_start + np.flatnonzero(window_columns)
+            consensus_symbols = matrix_nt_score_calculator(read_block(window_start, window_end)[:, window_columns],
+                                                           trace)
+            window_consensus = consensus_symbols[consensus_symbols != 0].tobytes().decode('ascii')
+            outfile.write(window_consensus)
+            count_consensus_symbols(window_consensus, consensus_statistics)
+        outfile.write('\n')
+
+    return consensus_statistics, primary_name
 
 
 def outfile_filler(consensus, input_file, output_path):
@@ -296,6 +468,36 @@ def outfile_filler(consensus, input_file, output_path):
             outfile.write(f'{name}\n{sequence}\n')
 
 
+def trace_file_path(input_file, output_path):
+    # {output_path}/{name}_ambiguous_columns.tsv for the input {name}.fasta or {name}.pal
+    return f"{output_path}/{input_file.stem}_ambiguous_columns.tsv"
+
+
+def file_consensus_generator(input_file, output_path, gap_size_defined, engine, trace=False, window=0):
+    # Process one input file (in the main or a worker process), only statistics are sent back to the caller
+    trace_outfile = None
+    if trace:
+        trace_outfile = open(trace_file_path(input_file, output_path), 'w', buffering=TRACE_BUFFER_SIZE)
+        trace_outfile.write('\t'.join(TRACE_COLUMNS) + '\n')
+
+    try:
+        # Packed alignments are always unpacked by blocks of columns from the memory map
+        if input_file.suffix == PACKED_SUFFIX:
+            window = window or PACKED_WINDOW
+        if window:
+            consensus_statistics, primary_name = windowed_consensus_generator(input_file, output_path,
+                                                                              gap_size_defined, window, trace_outfile)
+        else:
+            consensus, consensus_statistics, primary_name = consensus_generator(input_file, gap_size_defined, engine,
+                                                                                trace_outfile)
+            outfile_filler(consensus, input_file, output_path)
+    finally:
+        if trace_outfile is not None:
+            trace_outfile.close()
+
+    return primary_name, consensus_statistics
+
+
 def statistics_filler(consensus_statistics_total, input_path, output_path):
     with open(f'{output_path}/{input_path.name}_consensus_generator_report.md', 'a+') as report_outfile:
 
@@ -328,18 +530,29 @@ def statistics_filler(consensus_statistics_total, input_path, output_path):
 
 
 def main():
-    input_path, output_path, gap_size_defined = initialization()
+    input_path, output_path, gap_size_defined, engine, workers, incremental, packed, trace, window = initialization()
 
     output_folder_initialization(input_path, output_path)
 
     consensus_statistics_summary = defaultdict(dict)
 
-    for input_file in input_path.glob('*.fasta'):
-        consensus, consensus_statistics_temp, primary_name = consensus_generator(input_file, gap_size_defined)
+    # Both engines (whole alignment or windows) give the same consensus,
+    # so only GAP defines whether a previous result can be reused
+    manifest = load_manifest(output_path, 'consensus_generator') if incremental else None
+    parameters = {'gap': gap_size_defined}
+
+    # Files are sorted and results are collected in the same order, so the report doesn't depend on the workers
+    input_files = sorted(input_path.glob(f'*{PACKED_SUFFIX}' if packed else '*.fasta'))
+    file_results = incremental_map(file_consensus_generator, workers, input_files,
+                                   (output_path, gap_size_defined, engine, trace, window), manifest, parameters,
+                                   lambda input_file: [f"{output_path}/{input_file.stem}_filtered.fasta"] +
+                                   ([trace_file_path(input_file, output_path)] if trace else []))
 
+    for primary_name, consensus_statistics_temp in file_results:
         consensus_statistics_summary[primary_name] = consensus_statistics_temp
 
-        outfile_filler(consensus, input_file, output_path)
+    if incremental:
+        save_manifest(manifest, output_path, 'consensus_generator')
 
     statistics_filler(consensus_statistics_summary, input_path, output_path)
 
@@ -1,24 +1,17 @@
 import os
 import sys
-import pandas as pd
+from pathlib import Path
+
 import plotly.express as px
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Scripts directory with the shared common package
+from common.eggnog import annotation_files, load_annotations
+
 
-def load_annotations(input_directory):
-    cog_entries = []  # Use a list to collect entries
-    for filename in os.listdir(input_directory):
-        if filename.endswith('.annotations'):
-            sample_name = filename.split('.')[0]
-            file_path = os.path.join(input_directory, filename)
-            with open(file_path, 'r') as file:
-                for line in file:
-                    if line.startswith('#'):
-                        continue
-                    parts = line.strip().split('\t')
-                    cog_category = parts[5] if len(parts) > 5 else 'Unclassified'
-                    cog_entries.append({'Sample': sample_name, 'COG_Category': cog_category})
-    cog_data = pd.DataFrame(cog_entries)  # Convert the list of dictionaries to a DataFrame
-    return cog_data
+def load_cog_annotations(input_directory):
+    # Long table of samples and COG categories of all .annotations files
+    cog_data = load_annotations(annotation_files(input_directory, suffix='.annotations'), ('COG_category',))
+    return cog_data.rename(columns={'sample': 'Sample', 'COG_category': 'COG_Category'})
 
 
 def plot_distributions(cog_data, output_directory):
@@ -38,7 +31,7 @@ def plot_distributions(cog_data, output_directory):
 
 
 def main(input_directory, output_directory='.'):
-    cog_data = load_annotations(input_directory)
+    cog_data = load_cog_annotations(input_directory)
     plot_distributions(cog_data, output_directory)
 
 
@@ -1,59 +1,36 @@
-import os
-import pandas as pd
-import argparse
-
-
-def parse_emapper_annotations(annotations_path):
-    """
-    Parses the emapper.annotations file to extract the COG category counts.
-    """
-    cog_categories = {}
-    with open(annotations_path, 'r') as file:
-        for line in file:
-            if line.startswith('#') or line.strip() == '':
-                continue  # Skip header and empty lines
-            parts = line.strip().split('\t')
-            # Extract the highest level of taxonomy (e.g., Bacteria, Spirochaetes) from the eggNOG_OGs column
-            taxonomic_group = parts[4].split('@')[-1].split('|')[1] if '@' in parts[4] else None
-            if taxonomic_group:
-                cog_categories[taxonomic_group] = cog_categories.get(taxonomic_group, 0) + 1
-    return cog_categories
+import sys
+from pathlib import Path
 
+import argparse
+from argparse import ArgumentTypeError
 
-def generate_output(roary_file, annotations_dir, output_file):
-    # Read the Roary output file
-    roary_data = pd.read_csv(roary_file)
-    num_samples = len(roary_data.columns) - 14  # Adjust based on the number of metadata columns in the file
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Scripts directory with the shared common package
+from common.roary import load_presence_absence
+from common.eggnog import annotation_files, load_annotations, sample_counts
+from common.pangenome import CATEGORIES, DEFAULT_THRESHOLDS, threshold_arguments, category_thresholds, \
+    classify_genes, category_totals
 
-    # Get all the .annotations files from the directory
-    annotations_files = [os.path.join(annotations_dir, f) for f in os.listdir(annotations_dir) if
-                         f.endswith('.emapper.annotations')]
 
-    # Initialize the report data structure
-    report_data = {}
+def generate_output(roary_file, annotations_dir, output_file, thresholds=DEFAULT_THRESHOLDS):
+    # Read isolates and isolate counts of genes of the Roary output file (cached next to it)
+    isolates, isolate_counts = load_presence_absence(roary_file, 'isolates', 'counts')
+    num_samples = len(isolates)
 
-    # Parse each annotations file and accumulate the counts
-    for annotations_file in annotations_files:
-        sample_name = os.path.splitext(os.path.basename(annotations_file))[0]
-        cog_categories = parse_emapper_annotations(annotations_file)
-        report_data[sample_name] = cog_categories
+    # Count taxonomic groups (of the eggNOG_OGs column) of every .emapper.annotations file of the directory
+    annotations = load_annotations(annotation_files(annotations_dir), ('taxonomic_group',))
+    report_data = sample_counts(annotations, 'taxonomic_group')
 
     # Determine core, soft-core, shell, and cloud gene counts
-    core_genes = (roary_data.iloc[:, 14:] != '').all(axis=1).sum()
-    soft_core_genes = ((roary_data.iloc[:, 14:] != '').sum(axis=1) >= (0.95 * num_samples)).sum() - core_genes
-    shell_genes = ((roary_data.iloc[:, 14:] != '').sum(axis=1) > 1).sum() - core_genes - soft_core_genes
-    cloud_genes = ((roary_data.iloc[:, 14:] != '').sum(axis=1) == 1).sum()
+    totals = category_totals(classify_genes(isolate_counts, num_samples, thresholds))
 
     # Write the report to the output file
     with open(output_file, 'w') as f:
-        for sample, categories in report_data.items():
+        for sample, categories in report_data.iterrows():
             f.write(f"{sample}:\n")
-            for category, count in categories.items():
+            for category, count in categories[categories > 0].items():
                 f.write(f"{category}: {count}\n")
-            f.write(f"       Core: {core_genes}\n")
-            f.write(f"       Soft-core: {soft_core_genes}\n")
-            f.write(f"       Shell: {shell_genes}\n")
-            f.write(f"       Cloud: {cloud_genes}\n")
+            for category, total in zip(CATEGORIES, totals):
+                f.write(f"       {category}: {total}\n")
             f.write("\n")
 
 
@@ -63,6 +40,11 @@ if __name__ == "__main__":
     parser.add_argument('-r', '--roary', required=True, help='Roary output file (gene_presence_absence.csv)')
     parser.add_argument('-i', '--input', required=True, help='Directory containing .emapper.annotations files')
     parser.add_argument('-o', '--output', required=True, help='Output file to generate the report')
+    threshold_arguments(parser)
 
     args = parser.parse_args()
-    generate_output(args.roary, args.input, args.output)
+    try:
+        thresholds = category_thresholds(args)
+    except ArgumentTypeError as e:
+        parser.error(str(e))
+    generate_output(args.roary, args.input, args.output, thresholds)
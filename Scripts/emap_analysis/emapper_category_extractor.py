@@ -1,23 +1,39 @@
 import os
+import sys
+import zipfile
+from hashlib import sha256
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from scipy.cluster.hierarchy import dendrogram, linkage
 from pathlib import Path
 import argparse
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Scripts directory with the shared common package
+from common.eggnog import annotation_files, sample_name, file_counts, counts_table
+from common.manifest import load_manifest, save_manifest, incremental_map
+from common.plotting import pyplot, plot_arguments, selected_plots, render_plots
+
+# Figures of the script ({prefix}_{plot}.png)
+PLOTS = ('heatmap', 'clustered_bar', 'stacked_bar', 'dendrogram')
+
 # Setup argument parser
 parser = argparse.ArgumentParser(description='Parse emapper outputs and visualize COG categories')
 parser.add_argument('-i', '--input', help='Input directory with .emapper.annotations files', required=True)
 parser.add_argument('-o', '--output', help='Output directory for the results', default='.')
 parser.add_argument('-p', '--prefix', help='Prefix for the output files', default='combined_COG')
-
-# Parse arguments from command line
-args = parser.parse_args()
+parser.add_argument('-j', '--jobs', type=int, help='Number of worker processes, one annotations file per worker '
+                                                   '(default: 1)', default=1)
+parser.add_argument('-I', '--incremental', action='store_true',
+                    help='Reuse COG counts of unchanged annotations files from the manifest in the output directory')
+parser.add_argument('-c', '--collapse', type=int, default=0,
+                    help='Plot at most COLLAPSE sample clusters instead of samples when there are more samples '
+                         '(default: 0, plot every sample)')
+plot_arguments(parser, PLOTS)
 
 
 # Visualization functions
 def create_heatmap(df, output_dir, prefix):
+    plt = pyplot()
+    import seaborn as sns
     df = df[df.index.notnull()]
     plt.figure(figsize=(20, 16))
     sns.heatmap(df, annot=False, cmap='viridis', cbar_kws={'label': 'Count'})
@@ -29,6 +45,7 @@ def create_heatmap(df, output_dir, prefix):
 
 
 def create_clustered_bar_plot(df, output_dir, prefix):
+    plt = pyplot()
     df = df[df.index.notnull()]
     df.plot(kind='bar', stacked=False, figsize=(24, 16))
     plt.title('Clustered Bar Plot of COG Categories')
@@ -39,6 +56,7 @@ def create_clustered_bar_plot(df, output_dir, prefix):
 
 
 def create_stacked_bar_plot(df, output_dir, prefix):
+    plt = pyplot()
     df = df[df.index.notnull()]
     df.plot(kind='bar', stacked=True, figsize=(24, 16))
     plt.title('Stacked Bar Plot of COG Categories')
@@ -48,11 +66,16 @@ def create_stacked_bar_plot(df, output_dir, prefix):
     plt.close()
 
 
-def create_hierarchical_clustering(df, output_dir, prefix):
+def create_hierarchical_clustering(df, linkage_matrix, output_dir, prefix, collapse=0):
+    plt = pyplot()
+    from scipy.cluster.hierarchy import dendrogram
     df = df[df.index.notnull()]
-    linkage_matrix = linkage(df.T, 'ward')
     plt.figure(figsize=(20, 14))
-    dendrogram(linkage_matrix, labels=df.columns)
+    if collapse:
+        # Only the last COLLAPSE merges are drawn, collapsed leaves are labeled with their number of samples
+        dendrogram(linkage_matrix, truncate_mode='lastp', p=collapse, show_leaf_counts=True, labels=df.columns)
+    else:
+        dendrogram(linkage_matrix, labels=df.columns)
     plt.title('Hierarchical Clustering Dendrogram')
     plt.xlabel('Sample')
     plt.ylabel('Distance')
@@ -60,36 +83,65 @@ def create_hierarchical_clustering(df, output_dir, prefix):
     plt.close()
 
 
-def parse_emapper_to_cog_table(input_dir, output_dir, output_prefix):
+def sample_linkage(df, output_dir, prefix):
+    """
+    Ward linkage of samples (columns) by their COG category counts, computed once per table from the condensed
+    euclidean distances and cached in {prefix}_linkage.npz of the output directory (keyed by the table content)
+    """
+    from scipy.cluster.hierarchy import linkage
+    from scipy.spatial.distance import pdist
+    values = np.ascontiguousarray(df.T.to_numpy(dtype=np.float64))
+    key = sha256('\t'.join(map(str, [*df.index, '', *df.columns])).encode() + values.tobytes()).hexdigest()
+
+    cache_file = os.path.join(output_dir, f'{prefix}_linkage.npz')
+    try:
+        with np.load(cache_file) as cache:
+            if str(cache['key']) == key:
+                return cache['linkage']
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        pass
+
+    linkage_matrix = linkage(pdist(values), 'ward')
+    try:
+        # Write to a temporary file first, so an interrupted run never leaves a broken cache
+        with open(f'{cache_file}.tmp', 'wb') as handle:
+            np.savez(handle, key=key, linkage=linkage_matrix)
+        os.replace(f'{cache_file}.tmp', cache_file)
+    except OSError:
+        pass
+    return linkage_matrix
+
+
+def collapse_samples(df, linkage_matrix, clusters):
+    # Mean counts of at most CLUSTERS sample clusters (columns in the dendrogram order)
+    from scipy.cluster.hierarchy import fcluster, leaves_list
+    labels = fcluster(linkage_matrix, clusters, criterion='maxclust')
+    cluster_order = pd.unique(labels[leaves_list(linkage_matrix)])
+    sizes = np.bincount(labels)
+    collapsed = df.T.groupby(labels).mean().loc[cluster_order].T
+    collapsed.columns = [f'cluster {cluster} (n={sizes[cluster]})' for cluster in cluster_order]
+    return collapsed
+
+
+def parse_emapper_to_cog_table(input_dir, output_dir, output_prefix, jobs=1, incremental=False, collapse=0,
+                               plots=PLOTS):
     # Make sure the output directory exists, if not, create it
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # Initialize a dictionary to collect COG categories across all samples
-    cog_category_dict = {}
-
-    # Get a list of all .emapper.annotations files in the input directory
-    file_paths = list(Path(input_dir).rglob('*.emapper.annotations'))
+    # All .emapper.annotations files in the input directory (and subdirectories)
+    file_paths = annotation_files(input_dir, recursive=True)
 
-    # Process each file to populate the dictionary
-    for file_path in file_paths:
-        # Extract the sample name from the file name (remove the '.emapper' and extension)
-        sample_name = Path(file_path).stem.replace('.emapper', '')
-        df = pd.read_csv(file_path, sep='\t', header=None, skiprows=5, usecols=[6], names=['COG'])
-        df['COG'] = df['COG'].str.split('@').str[0]
+    # COG category counts of every file in parallel, counts of files unchanged since the previous run are reused
+    # (categories are kept in the order they first appear, the 'order' parameter invalidates older manifests)
+    manifest = load_manifest(output_dir, 'emapper_category_extractor') if incremental else None
+    cog_counts = list(incremental_map(file_counts, jobs, file_paths, ('COG_category',), manifest,
+                                      {'column': 'COG_category', 'order': 'first_seen'}, lambda file_path: []))
+    if incremental:
+        save_manifest(manifest, output_dir, 'emapper_category_extractor')
 
-        # Update the dictionary with counts for each category
-        for category in df['COG']:
-            if category not in cog_category_dict:
-                cog_category_dict[category] = {sample_name: 1}
-            else:
-                cog_category_dict[category][sample_name] = cog_category_dict[category].get(sample_name, 0) + 1
-
-    # Create a DataFrame from the dictionary
-    combined_df = pd.DataFrame.from_dict(cog_category_dict, orient='index').fillna(0).astype(int)
-
-    # Ensure the sample columns are sorted
-    combined_df = combined_df.reindex(sorted(combined_df.columns), axis=1)
+    # Count COG categories (rows) of every sample (sorted columns)
+    combined_df = counts_table(map(sample_name, file_paths), cog_counts)
 
     # Save the combined table to a CSV file
     output_file_path = os.path.join(output_dir, output_prefix + '.csv')
@@ -97,11 +149,49 @@ def parse_emapper_to_cog_table(input_dir, output_dir, output_prefix):
 
     print(f"Combined COG table saved to {output_file_path}")
 
-    create_heatmap(combined_df, output_dir, output_prefix)
-    create_clustered_bar_plot(combined_df, output_dir, output_prefix)
-    create_stacked_bar_plot(combined_df, output_dir, output_prefix)
-    create_hierarchical_clustering(combined_df, output_dir, output_prefix)
-
-
-# Call the function with provided arguments
-parse_emapper_to_cog_table(args.input, args.output, args.prefix)
+    if not plots:
+        return
+
+    # Samples are clustered once, the linkage orders heatmap columns and draws the dendrogram
+    plot_df = combined_df[combined_df.index.notnull()]
+    linkage_matrix = None
+    if (collapse or 'heatmap' in plots or 'dendrogram' in plots) and len(plot_df.columns) > 1:
+        linkage_matrix = sample_linkage(plot_df, output_dir, output_prefix)
+    collapse = collapse if linkage_matrix is not None and len(plot_df.columns) > collapse else 0
+    if collapse:
+        plot_df = collapse_samples(plot_df, linkage_matrix, collapse)
+
+    # Heatmap columns follow the dendrogram leaves (collapsed clusters are already in this order)
+    ordered_df = plot_df
+    if linkage_matrix is not None and not collapse:
+        from scipy.cluster.hierarchy import leaves_list
+        ordered_df = plot_df.iloc[:, leaves_list(linkage_matrix)]
+
+    figures = {
+        'heatmap': (create_heatmap, (ordered_df, output_dir, output_prefix)),
+        'clustered_bar': (create_clustered_bar_plot, (plot_df, output_dir, output_prefix)),
+        'stacked_bar': (create_stacked_bar_plot, (plot_df, output_dir, output_prefix)),
+        'dendrogram': (create_hierarchical_clustering, (combined_df, linkage_matrix, output_dir, output_prefix,
+                                                        collapse))
+    }
+    if 'dendrogram' in plots and linkage_matrix is None:
+        print('Hierarchical clustering needs at least two samples, dendrogram is not created')
+        del figures['dendrogram']
+
+    # Figures are independent, every one is rendered in its own worker process for several jobs
+    render_plots([figures[plot] for plot in plots if plot in figures], jobs)
+
+
+if __name__ == '__main__':
+    # Parse arguments from command line
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error(f'Number of jobs should be at least 1, got {args.jobs}')
+    if args.collapse < 0 or args.collapse == 1:
+        parser.error(f'Number of clusters should be at least 2 (or 0 to plot every sample), got {args.collapse}')
+
+    plots = selected_plots(parser, args, PLOTS)
+
+    # Call the function with provided arguments
+    parse_emapper_to_cog_table(args.input, args.output, args.prefix, args.jobs, args.incremental, args.collapse,
+                               plots)
@@ -1,8 +1,12 @@
 from collections import defaultdict
 from argparse import ArgumentParser, RawTextHelpFormatter, ArgumentError, ArgumentTypeError
 from pathlib import Path
-from re import sub
 from typing import Any
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Scripts directory with the shared common package
+from common.fasta_reader import fasta_records
+from common.manifest import load_manifest, save_manifest, incremental_map
 
 desc = "\nScript is used for sequences filtration (removing symbols)" \
        "\n\n└INPUT_DIRECTORY (exists)               └OUTPUT_DIRECTORY (exists or will be created)   " \
@@ -16,17 +20,23 @@ desc = "\nScript is used for sequences filtration (removing symbols)" \
        "This version is developed and implemented by Dmytro Tymoshenko (RA at the mentioned department), " \
        "MAY 02/2023, Github <https://github.com/edgeemer>"
 
-usage = "\npython <script_name>.py [-h] -i INPUT -o OUTPUT [-s SYMBOLS]\n" \
+usage = "\npython <script_name>.py [-h] -i INPUT -o OUTPUT [-s SYMBOLS] [-j JOBS] [-I]\n" \
         "Options:\n" \
         "-i, --input             Input directory path\n" \
         "-o, --output            Output directory path\n" \
-        "-s, --symbols           Symbols for removing (default: ?)\n"
+        "-s, --symbols           Symbols for removing (default: ?)\n" \
+        "-j, --jobs              Number of files processed in parallel (default: 1)\n" \
+        "-I, --incremental       Skip input files unchanged since the previous run with the same options\n"
 
 parser = ArgumentParser(description=desc, formatter_class=RawTextHelpFormatter, usage=usage)
 parser.add_argument('-i', '--input', type=str, help='Input directory path', required=True)
 parser.add_argument('-o', '--output', type=str, help='Output directory path', required=True)
 parser.add_argument('-s', '--symbols', type=str, help='Symbols for removing (default: ?)',
                     default="?")
+parser.add_argument('-j', '--jobs', type=int, help='Number of worker processes, one input file per worker (default: 1)',
+                    default=1)
+parser.add_argument('-I', '--incremental', action='store_true',
+                    help='Reuse results of unchanged input files from the manifest in the output directory')
 
 
 def initialisation():
@@ -40,8 +50,12 @@ def initialisation():
 
         # Optional
         symbols: str = args.symbols
+        jobs: int = args.jobs
+        if jobs < 1:
+            raise ArgumentTypeError(f"Number of jobs should be at least 1, got {jobs}")
+        incremental: bool = args.incremental
 
-        return input_path, output_path, symbols
+        return input_path, output_path, symbols, jobs, incremental
 
     except (ArgumentError, ArgumentTypeError) as e:
         print(f"Check help! Error: {e}")
@@ -49,8 +63,38 @@ def initialisation():
         exit(1)
 
 
+def clean_file(input_file, output_path, symbols):
+    # Clean one input file (in the main or a worker process) and return its lines of the removal report
+
+    # Create defaultdict to store cleaned sequences' parameters in the nested dict
+    sequence_left: defaultdict[Any, float] = defaultdict(float)
+
+    # Create/Overwrite the output file in the output directory
+    with open(f"{output_path}/{input_file.stem}_cleaned.fasta", 'w') \
+            as outfile:
+
+        # Stream records of the input file, only statistics of the cleaned sequences are kept in memory
+        for header, sequence in fasta_records(input_file):
+            # Remove all SYMBOLS from initial sequence in one pass (bytes.translate), symbols are taken literally
+            cleaned_sequence = sequence.encode().translate(None, symbols.encode()).decode()
+            # Calculate relevant statistics
+            sequence_left[header] = round((len(cleaned_sequence) / len(sequence)) * 100, 2)
+
+            # Write cleaned sequence to the output file
+            outfile.write(f"{header}\n{cleaned_sequence}\n")
+
+    # Add general sample name and number of left after filtration plasmids
+    report_lines = ['|{:^98}|{:^28}|\n'.format(f"<b>{input_file.stem}_clean.fasta</b>",
+                                                f"{len(sequence_left.keys())} sequences", ' ' * 26)]
+    # Add similarity result to the relevant plasmid assembly
+    for seq_name in sequence_left.keys():
+        report_lines.append('|{:^98}|{:^28}|\n'.format(seq_name.lstrip(">"), sequence_left[seq_name]))
+
+    return report_lines
+
+
 def main():
-    input_path, output_path, symbols = initialisation()
+    input_path, output_path, symbols, jobs, incremental = initialisation()
 
     # Create {output_path} if it doesn't exist
     output_path.mkdir() if not output_path.exists() else None
@@ -58,60 +102,33 @@ def main():
     with open(f'{output_path}/removal_report.md', 'w') as report_outfile:
         report_outfile.write('')
 
-    # Open input file and read lines into list
-    for input_file in input_path.glob('*.fasta'):
-        with open(input_file, 'r') as handle:
-            lines = handle.readlines()
-
-        # Create defaultdict to store sequences keyed by header
-        sequences = defaultdict(list)
-        header = ''
-        for line in lines:
-            header = line.strip() if line.startswith(">") else sequences[header].append(line.strip())
-
-        # Create defaultdict to store initial sequences in str type
-        str_sequences: defaultdict[Any, str] = defaultdict(str)
-        # Create defaultdict to store cleaned sequences in str type
-        cleaned_sequences: defaultdict[Any, str] = defaultdict(str)
-        # Create defaultdict to store cleaned sequences' parameters in the nested dict
-        sequence_left: defaultdict[Any, float] = defaultdict(float)
-
-        for header, sequence in sequences.items():
-            # Transform the original format of sequences (list) to the str
-            str_sequences[header] = ''.join(sequences[header])
-            # Remove all SYMBOLS from initial sequences and store them in a new defaultdict
-            cleaned_sequences[header] = sub(f"[{symbols}]", "", str_sequences[header])
-            # Calculate relevant statistics
-            sequence_left[header] = round((len(cleaned_sequences[header]) / len(str_sequences[header])) * 100, 2)
+    # Files are sorted and their report lines are merged in the same order for any number of jobs
+    input_files = sorted(input_path.glob('*.fasta'))
 
-        # Create/Overwrite the output file in the output directory
-        with open(f"{output_path}/{input_file.stem}_cleaned.fasta", 'w') \
-                as outfile:
+    # Report lines of input files unchanged since the previous run with the same options are reused
+    manifest = load_manifest(output_path, 'sequence_cleaner') if incremental else None
+    parameters = {'symbols': symbols}
 
-            # Write cleaned sequences to the output file
-            for header in cleaned_sequences.keys():
-                if header.startswith(">"):
-                    outfile.write(f"{header}\n{cleaned_sequences[header]}\n")
+    # Open previously created report file
+    with open(f'{output_path}/removal_report.md', 'a+') as report_outfile:
 
-        # Open previously created report file
-        with open(f'{output_path}/removal_report.md', 'a+') as report_outfile:
+        # Templates for lines
+        report_header = '|{:^98}|{:^28}|\n'.format('Sequence name', f'% after removing {symbols}')
+        empty_line_header = '|:{:^96}:|:{:^26}:|\n'.format('-' * 96, '-' * 26)
 
-            # Templates for lines
-            report_header = '|{:^98}|{:^28}|\n'.format('Sequence name', f'% after removing {symbols}')
-            empty_line_header = '|:{:^96}:|:{:^26}:|\n'.format('-' * 96, '-' * 26)
-            header_output_line = '|{:^98}|{:^28}|\n'.format(f"<b>{input_file.stem}_clean.fasta</b>",
-                                                            f"{len(cleaned_sequences.keys())} sequences", ' ' * 26)
+        file_results = incremental_map(clean_file, jobs, input_files, (output_path, symbols), manifest, parameters,
+                                       lambda input_file: [f"{output_path}/{input_file.stem}_cleaned.fasta"])
 
+        for report_lines in file_results:
             # Create header in case of new file
             if report_outfile.tell() == 0:
                 report_outfile.write(report_header)
                 report_outfile.write(empty_line_header)
 
-            # Add general sample name and number of left after filtration plasmids
-            report_outfile.write(header_output_line)
-            # Add similarity result to the relevant plasmid assembly
-            for seq_name in cleaned_sequences.keys():
-                report_outfile.write('|{:^98}|{:^28}|\n'.format(seq_name.lstrip(">"), sequence_left[seq_name]))
+            report_outfile.writelines(report_lines)
+
+    if incremental:
+        save_manifest(manifest, output_path, 'sequence_cleaner')
 
     print("Successful run!")  # For log output
 
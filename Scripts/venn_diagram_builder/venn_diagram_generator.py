@@ -1,7 +1,10 @@
 import os
+import sys
 import argparse
-import venn
-import matplotlib.pyplot as plt
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Scripts directory with the shared common package
+from common.plotting import pyplot
 
 
 # Function to read genes from a file
@@ -14,6 +17,8 @@ def read_genes(file_path):
 # Function to create a Venn diagram for the given sets
 def create_venn_diagram(sets, output_path):
     if 2 <= len(sets) <= 6:
+        plt = pyplot()
+        import venn
         venn.venn(sets)
         plt.savefig(output_path, bbox_inches='tight')
         plt.close()